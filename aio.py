@@ -0,0 +1,84 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# -----------------------------
+# Async execution mode
+# -----------------------------
+# With ASYNC_MODE=1 the apps register async route handlers (needs
+# `pip install "flask[async]"`). Their network I/O runs as coroutines on one
+# shared background event loop, so the async HTTP and Groq clients (and their
+# connection pools) are created once per process and every in-flight
+# classification shares them.
+ASYNC_MODE = os.getenv("ASYNC_MODE", "") == "1"
+# Threads for blocking store calls (SQLite) made by coroutines on the loop
+BLOCKING_THREADS = int(os.getenv("AIO_BLOCKING_THREADS", "4"))
+
+_loop = None
+_loop_lock = threading.Lock()
+_shared = {}
+_blocking_pool = None
+
+def get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="aio-loop", daemon=True).start()
+        return _loop
+
+def _reset_after_fork():
+    # The loop thread does not survive a fork, and clients made on the
+    # parent's loop cannot be used from a new one
+    global _loop, _loop_lock, _blocking_pool
+    _loop = None
+    _loop_lock = threading.Lock()
+    _shared.clear()
+    _blocking_pool = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def run(coro):
+    """
+    Run a coroutine on the shared loop and block until it finishes.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+def spawn(coro):
+    """
+    Schedule a coroutine on the shared loop and return a concurrent Future.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+async def submit(coro):
+    """
+    Await a coroutine on the shared loop from any other event loop
+    (e.g. the per-request loop Flask uses for async views).
+    """
+    return await asyncio.wrap_future(spawn(coro))
+
+def shared(name, factory):
+    """
+    Return a client that lives on the shared loop, creating it on first use.
+    Must be called from a coroutine running on that loop.
+    """
+    client = _shared.get(name)
+    if client is None:
+        client = _shared[name] = factory()
+    return client
+
+async def blocking(fn, *args, **kwargs):
+    """
+    Await fn(*args, **kwargs) run on a small pool of its own, for store
+    reads and writes that can wait on SQLite's busy timeout. The loop keeps
+    serving other coroutines meanwhile, and the default executor stays free.
+    """
+    global _blocking_pool
+    with _loop_lock:
+        if _blocking_pool is None:
+            _blocking_pool = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix="aio-blocking")
+        pool = _blocking_pool
+    return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(fn, *args, **kwargs))
@@ -1,23 +1,32 @@
 from flask import Flask, request, jsonify
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import os
+import aio
+import metrics
+import timing
+import llm_cache
+import llm_json
+import llm_scheduler
+import ticket_queue
+import ticket_preclassifier
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 
-# Groq API client setup
+# Groq API client setup (GROQ_BASE_URL points it elsewhere, e.g. a local stand-in)
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com").rstrip("/")
 client = OpenAI(
     api_key=os.getenv("GROQ_API_KEY"),  # set your env var
-    base_url="https://api.groq.com/openai/v1"
+    base_url=f"{GROQ_BASE_URL}/openai/v1"
 )
 
+MODEL = "llama-3.1-8b-instant"
+
 # Allowed categories for validation
 ALLOWED_CATEGORIES = ["BILLING", "TECHNICAL", "COMPLAINT", "PRAISE"]
 
-def classify_ticket(ticket_text: str) -> str:
-    """
-    Calls Groq LLM to classify a ticket.
-    Returns a valid category or 'HUMAN_REVIEW' if output is unexpected.
-    """
+@timing.timed("prompt")
+def build_messages(ticket_text: str) -> list:
     prompt = f"""
     You are a strict ticket classifier.
     Categories: BILLING, TECHNICAL, COMPLAINT, PRAISE
@@ -27,23 +36,209 @@ def classify_ticket(ticket_text: str) -> str:
     {ticket_text}
     """
 
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": "You are a helpful classifier."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-
-    # Extract the model's response
-    category = response.choices[0].message.content.strip().upper()
+    return [
+        {"role": "system", "content": "You are a helpful classifier."},
+        {"role": "user", "content": prompt}
+    ]
 
-    # Validate the category
+@timing.timed("parse")
+def validate_category(output: str) -> str:
+    category = output.strip().upper()
     if category not in ALLOWED_CATEGORIES:
         return "HUMAN_REVIEW"
+    return category
+
+def classify_ticket(ticket_text: str) -> str:
+    """
+    Calls Groq LLM to classify a ticket.
+    Returns a valid category or 'HUMAN_REVIEW' if output is unexpected.
+    """
+    response = llm_scheduler.create(
+        client.chat.completions.create,
+        model=MODEL,
+        messages=build_messages(ticket_text)
+    )
+    llm_cache.record_usage(response)
+
+    # Extract and validate the model's response
+    category = validate_category(response.choices[0].message.content)
+    log_labels([ticket_text], [category])
+    return category
 
+async def classify_ticket_async(ticket_text: str) -> str:
+    async_client = aio.shared("openai", lambda: AsyncOpenAI(
+        api_key=os.getenv("GROQ_API_KEY"),
+        base_url=f"{GROQ_BASE_URL}/openai/v1"
+    ))
+    response = await llm_scheduler.create_async(
+        async_client.chat.completions.create,
+        model=MODEL,
+        messages=build_messages(ticket_text)
+    )
+    llm_cache.record_usage(response)
+    category = validate_category(response.choices[0].message.content)
+    await aio.blocking(log_labels, [ticket_text], [category])
     return category
 
+# -----------------------------
+# Local fast path
+# -----------------------------
+# Trained offline with `python ticket_preclassifier.py train` from the
+# labels logged below; confident tickets skip the LLM entirely.
+PRECLASSIFIER = ticket_preclassifier.load_default()
+# Audits of confident answers run off the request path
+audit_pool = ThreadPoolExecutor(max_workers=2)
+
+def log_labels(tickets: list, categories: list):
+    ticket_queue.record_labels([
+        (text, category) for text, category in zip(tickets, categories) if category != "HUMAN_REVIEW"
+    ])
+
+def audit_ticket(ticket_text: str, guess: str):
+    with llm_scheduler.lane("batch"):
+        category = classify_ticket(ticket_text)
+    ticket_preclassifier.record_agreement(guess, category, audited=True)
+
+def triage_ticket(ticket_text: str) -> str:
+    """
+    Answer from the local pre-classifier when it is confident, else ask the LLM.
+    """
+    category, guess, audit = ticket_preclassifier.fast_answer(PRECLASSIFIER, ticket_text)
+    if category is not None:
+        if audit:
+            audit_pool.submit(audit_ticket, ticket_text, guess)
+        return category
+    category = classify_ticket(ticket_text)
+    ticket_preclassifier.record_agreement(guess, category, audited=False)
+    return category
+
+async def triage_ticket_async(ticket_text: str) -> str:
+    category, guess, audit = ticket_preclassifier.fast_answer(PRECLASSIFIER, ticket_text)
+    if category is not None:
+        if audit:
+            audit_pool.submit(audit_ticket, ticket_text, guess)
+        return category
+    category = await classify_ticket_async(ticket_text)
+    ticket_preclassifier.record_agreement(guess, category, audited=False)
+    return category
+
+# -----------------------------
+# Batched classification
+# -----------------------------
+# Longer tickets are cut so one verbose ticket cannot crowd out the batch
+MAX_TICKET_CHARS = int(os.getenv("TICKET_MAX_CHARS", "2000"))
+
+@timing.timed("prompt")
+def build_batch_messages(tickets: list) -> list:
+    numbered = "\n\n".join(
+        f"[{i}] {text[:MAX_TICKET_CHARS]}" for i, text in enumerate(tickets, start=1)
+    )
+    prompt = f"""
+    You are a strict ticket classifier.
+    Categories: BILLING, TECHNICAL, COMPLAINT, PRAISE
+    Classify every ticket below on its own.
+    Return ONLY a JSON object mapping each ticket number to its category,
+    for example {{"1": "BILLING", "2": "PRAISE"}}.
+
+    Tickets:
+    {numbered}
+    """
+
+    return [
+        {"role": "system", "content": "You are a helpful classifier."},
+        {"role": "user", "content": prompt}
+    ]
+
+@timing.timed("parse")
+def parse_batch_output(output: str, count: int) -> list:
+    """
+    One validated category per ticket; a ticket the model skipped or
+    answered outside ALLOWED_CATEGORIES gets 'HUMAN_REVIEW'. Raises
+    ValueError if the output holds no JSON at all.
+    """
+    answers = llm_json.loads(output)
+    if isinstance(answers, list):
+        answers = {str(i): a for i, a in enumerate(answers, start=1)}
+    return [validate_category(str(answers.get(str(i), ""))) for i in range(1, count + 1)]
+
+def classify_ticket_batch(tickets: list) -> list:
+    """
+    Called by the ticket_queue workers; nobody is waiting on the page, so
+    their LLM calls yield to interactive /submit_ticket requests.
+    """
+    with llm_scheduler.lane("batch"):
+        return _classify_ticket_batch(tickets)
+
+def _classify_ticket_batch(tickets: list) -> list:
+    categories, guesses, deferred = [], [], []
+    for i, text in enumerate(tickets):
+        category, guess, audit = ticket_preclassifier.fast_answer(PRECLASSIFIER, text)
+        if category is not None and audit:
+            audit_pool.submit(audit_ticket, text, guess)
+        if category is None:
+            deferred.append(i)
+        categories.append(category)
+        guesses.append(guess)
+    if not deferred:
+        return categories
+
+    # Only the tickets the fast path could not answer go to the LLM
+    texts = [tickets[i] for i in deferred]
+    if len(texts) == 1:
+        answers = [classify_ticket(texts[0])]
+    else:
+        try:
+            # Parsed before caching, so output with no JSON is not replayed
+            answers = llm_cache.cached_completion(
+                client, model=MODEL, messages=build_batch_messages(texts), temperature=0,
+                parse=lambda output: parse_batch_output(output, len(texts))
+            )
+        except ValueError:
+            answers = ["HUMAN_REVIEW"] * len(texts)
+        log_labels(texts, answers)
+    for i, answer in zip(deferred, answers):
+        ticket_preclassifier.record_agreement(guesses[i], answer, audited=False)
+        categories[i] = answer
+    return categories
+
+ticket_batches = ticket_queue.TicketQueue(classify_ticket_batch)
+
+@app.route("/tickets", methods=["POST"])
+def queue_tickets():
+    """
+    Expects JSON: {"ticket": "..."} or {"tickets": ["...", ...]}, plus an
+    optional "webhook" URL that receives each result as it is classified.
+    Returns 202 with one ID per ticket; poll GET /tickets/<id> for results.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    texts = data.get("tickets") if isinstance(data.get("tickets"), list) else [data.get("ticket", "")]
+    if not all(isinstance(t, str) for t in texts):
+        return jsonify({"error": "Every ticket must be a string"}), 400
+    texts = [t.strip() for t in texts]
+    if not texts or not all(texts):
+        return jsonify({"error": "No ticket provided"}), 400
+    webhook = data.get("webhook") or None
+    if webhook is not None:
+        try:
+            if not isinstance(webhook, str):
+                raise ValueError("webhook must be a URL string")
+            ticket_queue.check_webhook(webhook)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    ids = ticket_batches.submit(texts, webhook=webhook)
+    return jsonify({"ids": ids, "status": "queued"}), 202
+
+@app.route("/tickets/<ticket_id>", methods=["GET"])
+def ticket_status(ticket_id):
+    # A worker restarted since the ticket was queued picks it up again
+    ticket_batches.start()
+    ticket = ticket_queue.get(ticket_id)
+    if ticket is None:
+        return jsonify({"error": "Unknown ticket id"}), 404
+    return jsonify(ticket)
+
 @app.route("/submit_ticket", methods=["POST"])
 def submit_ticket():
     """
@@ -55,8 +250,11 @@ def submit_ticket():
     if not ticket_text:
         return jsonify({"error": "No ticket provided"}), 400
 
-    # Step 1: classify ticket
-    category = classify_ticket(ticket_text)
+    # Step 1: classify ticket (locally when the pre-classifier is confident)
+    try:
+        category = triage_ticket(ticket_text)
+    except llm_scheduler.LLMBusyError as e:
+        return jsonify({"error": str(e)}), 503
 
     # Step 2: route / log
     # Here we just print to console (replace with DB or queue in production)
@@ -65,5 +263,34 @@ def submit_ticket():
 
     return jsonify({"ticket": ticket_text, "category": category})
 
+async def submit_ticket_async():
+    data = request.json
+    ticket_text = data.get("ticket", "").strip()
+
+    if not ticket_text:
+        return jsonify({"error": "No ticket provided"}), 400
+
+    try:
+        category = await aio.submit(triage_ticket_async(ticket_text))
+    except llm_scheduler.LLMBusyError as e:
+        return jsonify({"error": str(e)}), 503
+
+    print(f"Ticket: {ticket_text}")
+    print(f"Assigned Category: {category}")
+
+    return jsonify({"ticket": ticket_text, "category": category})
+
+# GET /metrics plus per-request timing
+metrics.install(app, extra=[
+    ("ticket_queue_total", "Queued ticket pipeline events", ticket_queue.QUEUE_STATS, "event"),
+    ("ticket_preclassifier_total", "Pre-classifier answers, deferrals and agreement with the LLM",
+     ticket_preclassifier.PRECLASSIFY_STATS, "event")
+])
+
+if aio.ASYNC_MODE:
+    app.view_functions["submit_ticket"] = submit_ticket_async
+
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
+    # Development server only (FLASK_DEBUG=1 turns on the debugger);
+    # use `python serve.py tickets` in production
+    app.run(port=5000)
@@ -0,0 +1,303 @@
+import io
+import os
+import re
+import html
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import logging
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
+# -----------------------------
+# Offline benchmark harness
+# -----------------------------
+# Starts local stand-ins for bible-api.com and the Groq API, serves the
+# four Flask apps in-process against them, drives each app's main route
+# at a fixed concurrency and reports latency percentiles, throughput and
+# the per-stage timings from timing.py. Needs no network.
+#
+#   python bench.py [--requests 200] [--concurrency 8] [--llm-latency 0.4]
+#                   [--api-latency 0.05] [--targets doctrine,themes,category,ticket,ticket_queue]
+#                   [--verses-db verses.db] [--completions recorded.json] [--warm] [--json]
+
+DEFAULT_CHAPTERS = [
+    "Genesis 1", "Psalms 23", "Psalms 119", "Isaiah 53", "Matthew 5", "John 3",
+    "Romans 8", "1 Corinthians 13", "Ephesians 2", "Hebrews 11", "James 1", "Revelation 21"
+]
+
+TICKETS = [
+    "I was charged twice for my subscription this month.",
+    "The app crashes whenever I try to upload a file.",
+    "Your support agent was rude and never called me back.",
+    "Thanks, the new dashboard is fantastic!"
+]
+
+# Completions replayed by the fake Groq server, chosen by what the prompt asks for
+COMPLETIONS = {
+    "doctrine": json.dumps({
+        "main_lesson": {"lesson": "Obey God and leave all the consequences to Him", "key_verse": "1"},
+        "other_lessons": [
+            {"lesson": "Faith", "key_verse": "2"},
+            {"lesson": "Justification", "key_verse": "3"}
+        ]
+    }),
+    "themes": json.dumps({
+        "main_theme": {"theme": "SALVATION", "key_verse": "1: In the beginning"},
+        "sub_themes": [{"theme": "FAITH", "key_verse": "2: And the earth"}]
+    }),
+    "ticket": "TECHNICAL"
+}
+
+def synthetic_verses(ref, count=30):
+    rng = random.Random(ref)
+    words = "grace faith law spirit love mercy truth light life peace hope glory".split()
+    return [
+        {"verse": i, "text": " ".join(rng.choice(words) for _ in range(18)).capitalize() + "."}
+        for i in range(1, count + 1)
+    ]
+
+# -----------------------------
+# Fake upstream servers
+# -----------------------------
+class Quiet(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def bible_api_handler(recorded, latency):
+    class Handler(Quiet):
+        def do_GET(self):
+            time.sleep(latency)
+            ref = unquote_plus(self.path.lstrip("/"))
+            verses = recorded.get(ref.lower()) or synthetic_verses(ref.lower())
+            self.send_json({"reference": ref, "verses": verses})
+    return Handler
+
+def groq_handler(completions, latency):
+    class Handler(Quiet):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", "0"))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            prompt = " ".join(str(m.get("content", "")) for m in request.get("messages", []))
+            batch = re.findall(r"^\s*\[(\d+)\]", prompt, re.MULTILINE)
+            if "main_lesson" in prompt:
+                content = completions["doctrine"]
+            elif batch:
+                content = json.dumps({n: completions["ticket"] for n in batch})
+            elif "main_theme" in prompt:
+                content = completions["themes"]
+            else:
+                content = completions["ticket"]
+            time.sleep(latency)
+            self.send_json({
+                "id": "bench", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model", ""),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(prompt) + len(content)) // 4}
+            })
+    return Handler
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def load_recorded_verses(path):
+    if not path:
+        return {}
+    import sqlite3
+    conn = sqlite3.connect(path)
+    return {ref: json.loads(verses) for ref, verses in conn.execute("SELECT ref, verses FROM chapters")}
+
+# -----------------------------
+# Load generation
+# -----------------------------
+def drive(send, payloads, concurrency):
+    """
+    Run send(payload) for every payload with `concurrency` workers.
+    Returns (latencies, errors, elapsed).
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def one(payload):
+        start = time.perf_counter()
+        try:
+            send(payload)
+            ok = None
+        except Exception as e:
+            ok = e
+        elapsed = time.perf_counter() - start
+        with lock:
+            (errors.append(str(ok)) if ok else latencies.append(elapsed))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, payloads))
+    return latencies, errors, time.perf_counter() - start
+
+def check(response):
+    response.raise_for_status()
+    if response.headers.get("Content-Type", "").startswith("application/json"):
+        data = response.json()
+        if isinstance(data, dict) and "error" in data:
+            raise RuntimeError(data["error"])
+    return response
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the classifier apps against local fake upstreams.")
+    parser.add_argument("--requests", type=int, default=200, help="requests per target")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.4)
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    parser.add_argument("--targets", default="doctrine,themes,category,ticket")
+    parser.add_argument("--verses-db", default="", help="replay chapters recorded in a verse store")
+    parser.add_argument("--completions", default="", help="JSON file of recorded completions by kind")
+    parser.add_argument("--warm", action="store_true", help="leave the LLM cache and classification index on")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    completions = dict(COMPLETIONS)
+    if args.completions:
+        with open(args.completions, encoding="utf-8") as f:
+            completions.update(json.load(f))
+
+    api_url = serve(ThreadingHTTPServer(("127.0.0.1", 0), bible_api_handler(load_recorded_verses(args.verses_db), args.api_latency)))
+    groq_url = serve(ThreadingHTTPServer(("127.0.0.1", 0), groq_handler(completions, args.llm_latency)))
+
+    # The apps read these at import time
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.update({
+        "BIBLE_API_URL": api_url,
+        "GROQ_BASE_URL": groq_url,
+        "GROQ_API_KEY": os.environ.get("GROQ_API_KEY", "bench"),
+        "BIBLE_VERSE_DB": os.path.join(workdir, "verses.db"),
+        "CLASSIFICATION_INDEX_DB": os.path.join(workdir, "classifications.db"),
+        "TICKET_DB": os.path.join(workdir, "tickets.db"),
+        "LLM_CACHE_DB": ""
+    })
+    if not args.warm:
+        os.environ["LLM_CACHE_SIZE"] = "0"
+    # The fake Groq server has no rate limits; set these to bench the scheduler
+    os.environ.setdefault("LLM_RPM", "0")
+    os.environ.setdefault("LLM_TPM", "0")
+
+    import requests
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    import timing
+    import bible_chap_doctrine_wa
+    import bible_chap_cat_webapp
+    import bible_chapter_category
+    import app as ticket_app
+
+    def app_url(flask_app):
+        return serve(make_server("127.0.0.1", 0, flask_app, threaded=True))
+
+    refresh = {} if args.warm else {"refresh": "1"}
+    urls = {}
+    http = threading.local()
+
+    def session():
+        if not hasattr(http, "session"):
+            http.session = requests.Session()
+        return http.session
+
+    def form_target(flask_app, error_re):
+        # The form pages report failures inline, so look for the error markup
+        url = urls.setdefault(flask_app.name, app_url(flask_app))
+        def send(ref):
+            text = check(session().post(url + "/", data={"chapter": ref, **refresh})).text
+            error = re.search(error_re, text)
+            if error:
+                raise RuntimeError(html.unescape(error.group(1)).strip())
+        return send
+
+    def category_target():
+        url = app_url(bible_chapter_category.app)
+        return lambda ref: check(session().post(url + "/classify_chapter", json={"chapter": ref}))
+
+    def ticket_target():
+        url = urls.setdefault(ticket_app.app.name, app_url(ticket_app.app))
+        return lambda text: check(session().post(url + "/submit_ticket", json={"ticket": text}))
+
+    def ticket_queue_target():
+        # End to end: accepted by /tickets, then polled until classified
+        url = urls.setdefault(ticket_app.app.name, app_url(ticket_app.app))
+        def send(text):
+            ticket_id = check(session().post(url + "/tickets", json={"ticket": text})).json()["ids"][0]
+            while True:
+                ticket = check(session().get(f"{url}/tickets/{ticket_id}")).json()
+                if ticket["status"] != "queued":
+                    break
+                time.sleep(0.01)
+            if ticket["status"] != "done":
+                raise RuntimeError(ticket.get("error", ticket["status"]))
+        return send
+
+    targets = {
+        "doctrine": (lambda: form_target(bible_chap_doctrine_wa.app, r'<p style="color:red;">([^<]+)</p>'), DEFAULT_CHAPTERS),
+        "themes": (lambda: form_target(bible_chap_cat_webapp.app, r'<p class="error">([^<]+)</p>'), DEFAULT_CHAPTERS),
+        "category": (category_target, DEFAULT_CHAPTERS),
+        "ticket": (ticket_target, TICKETS),
+        "ticket_queue": (ticket_queue_target, TICKETS)
+    }
+
+    report = {}
+    for name in [t.strip() for t in args.targets.split(",") if t.strip()]:
+        make_send, inputs = targets[name]
+        send = make_send()
+        payloads = [inputs[i % len(inputs)] for i in range(args.requests)]
+        timing.reset()
+        # The apps print every ticket; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies, errors, elapsed = drive(send, payloads, args.concurrency)
+        report[name] = {
+            "requests": len(payloads),
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": timing.percentile(latencies, 50) * 1000,
+            "p95_ms": timing.percentile(latencies, 95) * 1000,
+            "p99_ms": timing.percentile(latencies, 99) * 1000,
+            "stages_ms": {
+                stage: {k: (v * 1000 if k != "count" else v) for k, v in stats.items()}
+                for stage, stats in timing.snapshot().items()
+            }
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"concurrency {args.concurrency}, {args.requests} requests per target, "
+          f"LLM latency {args.llm_latency * 1000:.0f} ms, bible-api latency {args.api_latency * 1000:.0f} ms"
+          f"{', warm caches' if args.warm else ''}\n")
+    for name, r in report.items():
+        print(f"{name:12} {r['throughput_rps']:7.1f} req/s  p50 {r['p50_ms']:7.1f} ms  "
+              f"p95 {r['p95_ms']:7.1f} ms  p99 {r['p99_ms']:7.1f} ms  errors {r['errors']}")
+        if r["first_error"]:
+            print(f"             first error: {r['first_error']}")
+        for stage, s in sorted(r["stages_ms"].items(), key=lambda item: -item[1]["mean"]):
+            print(f"             {stage:10} n={s['count']:<5} mean {s['mean']:7.2f} ms  "
+                  f"p95 {s['p95']:7.2f} ms  max {s['max']:7.2f} ms")
+        print()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,18 @@
-from flask import Flask, request, render_template_string
-from groq import Groq
+from flask import Flask, request, render_template, jsonify
+from groq import Groq, AsyncGroq
 import os
-import requests
+import verse_store
+import bible_refs
+import classification_index
+from single_flight import SingleFlight
+import llm_cache
+import timing
+import aio
+import metrics
+import page_cache
+import structured_output
 import json
+import re
 
 app = Flask(__name__)
 
@@ -15,13 +25,7 @@ client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 # Bible chapter fetcher
 # -----------------------------
 def fetch_bible_chapter(chapter_ref):
-    query = chapter_ref.lower().replace(" ", "+")
-    url = f"https://bible-api.com/{query}"
-    response = requests.get(url)
-    if response.status_code != 200:
-        return None
-    data = response.json()
-    return data.get("verses", [])
+    return verse_store.get_chapter(chapter_ref)
 
 # -----------------------------
 # Web page template with widgets
@@ -43,7 +47,8 @@ HTML_TEMPLATE = """
 <body>
   <h1>Bible Chapter Classifier</h1>
   <form method="post">
-    Chapter Reference: <input type="text" name="chapter" placeholder="Romans 3">
+    Chapter Reference: <input type="text" name="chapter" placeholder="Romans 3" value="{{ chapter }}">
+    <label><input type="checkbox" name="refresh" value="1"> Reclassify</label>
     <input type="submit" value="Classify">
   </form>
 
@@ -71,14 +76,9 @@ HTML_TEMPLATE = """
 # -----------------------------
 # Internal classification
 # -----------------------------
-def classify_chapter_internal(chapter_ref):
-    verses_data = fetch_bible_chapter(chapter_ref)
-    if not verses_data:
-        raise ValueError(f"Could not find chapter: {chapter_ref}")
+MODEL = "llama-3.1-8b-instant"
 
-    chapter_text = " ".join(f"{v['verse']}: {v['text']}" for v in verses_data)
-
-    MAIN_THEMES = """
+MAIN_THEMES = """
 SIN_AND_JUDGMENT
 JUSTIFICATION
 SALVATION
@@ -89,7 +89,7 @@ PRAISE
 TRUST_IN_GOD
 REPENTANCE
 """
-    SUB_THEMES = """
+SUB_THEMES = """
 FAITH
 CHRISTOLOGY
 HOLY_SPIRIT
@@ -100,6 +100,10 @@ POETRY_PRAISE
 DIVINE_PROTECTION
 """
 
+@timing.timed("prompt")
+def build_messages(verses_data):
+    chapter_text = " ".join(f"{v['verse']}: {v['text']}" for v in verses_data)
+
     prompt = f"""
 You are a Bible scholar. Read the chapter below and:
 
@@ -124,26 +128,158 @@ Chapter:
 \"\"\"
 """
 
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": "You are a precise theological classifier."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0
-    )
+    return [
+        {"role": "system", "content": "You are a precise theological classifier."},
+        {"role": "user", "content": prompt}
+    ]
 
-    output_text = response.choices[0].message.content.strip()
+@timing.timed("parse")
+def parse_output(output_text):
+    output_text = output_text.strip()
     try:
         return json.loads(output_text)
     except Exception:
         raise ValueError(f"LLM did not return valid JSON:\n{output_text}")
 
+# -----------------------------
+# Structured-output classification
+# -----------------------------
+def structured_request(verses_data):
+    verse_numbers = {str(v["verse"]) for v in verses_data}
+    main_item = structured_output.item_schema("theme", MAIN_THEMES.split())
+    sub_item = structured_output.item_schema("theme", SUB_THEMES.split())
+    schema = structured_output.result_schema("main_theme", "sub_themes", sub_item, max_items=2)
+    schema["properties"]["main_theme"] = main_item
+
+    def theme_check(allowed):
+        def is_valid(theme):
+            verse = re.match(r'\s*(\d+)', str(theme.get("key_verse", "")))
+            return theme.get("theme") in allowed and verse is not None and verse.group(1) in verse_numbers
+        return is_valid
+
+    return dict(
+        messages=build_messages(verses_data),
+        name="chapter_themes",
+        schema=schema,
+        main_key="main_theme",
+        list_key="sub_themes",
+        # json_object mode has no schema, so each slot is checked against its own list
+        item=sub_item,
+        is_valid=theme_check(set(SUB_THEMES.split())),
+        main_item=main_item,
+        is_valid_main=theme_check(set(MAIN_THEMES.split())),
+        problem="The main theme must come from the main theme list, each sub-theme from the sub-theme list, "
+                "and key_verse must start with a verse number from this chapter."
+    )
+
+def classify_chapter_internal(chapter_ref):
+    verses_data = fetch_bible_chapter(chapter_ref)
+    if not verses_data:
+        raise ValueError(f"Could not find chapter: {chapter_ref}")
+
+    if structured_output.enabled():
+        def complete(messages, response_format):
+            return llm_cache.cached_completion(
+                client, model=MODEL, messages=messages, temperature=0, response_format=response_format,
+                parse=structured_output.json_text
+            )
+        return structured_output.classify(complete, **structured_request(verses_data))
+
+    # Parsed before caching, so invalid JSON is asked for again next time
+    return llm_cache.cached_completion(
+        client,
+        model=MODEL,
+        messages=build_messages(verses_data),
+        temperature=0,
+        parse=parse_output
+    )
+
+async def classify_chapter_internal_async(chapter_ref):
+    verses_data = await verse_store.get_chapter_async(chapter_ref)
+    if not verses_data:
+        raise ValueError(f"Could not find chapter: {chapter_ref}")
+
+    async_client = aio.shared("groq", lambda: AsyncGroq(api_key=os.getenv("GROQ_API_KEY")))
+    if structured_output.enabled():
+        async def complete(messages, response_format):
+            return await llm_cache.cached_completion_async(
+                async_client, model=MODEL, messages=messages, temperature=0, response_format=response_format,
+                parse=structured_output.json_text
+            )
+        return await structured_output.classify_async(complete, **structured_request(verses_data))
+
+    return await llm_cache.cached_completion_async(
+        async_client,
+        model=MODEL,
+        messages=build_messages(verses_data),
+        temperature=0,
+        parse=parse_output
+    )
+
+# -----------------------------
+# Index-first classification
+# -----------------------------
+INDEX_KIND = "themes"
+
+# Concurrent requests for the same chapter share one fetch and LLM call;
+# a forced refresh always runs on its own
+flights = SingleFlight()
+
+def classify_chapter(chapter_ref, refresh=False):
+    if refresh:
+        return classification_index.cached_classify(
+            chapter_ref, INDEX_KIND, MODEL, classify_chapter_internal, refresh=True
+        )
+    return flights.do(
+        verse_store.normalize_ref(chapter_ref), classification_index.cached_classify,
+        chapter_ref, INDEX_KIND, MODEL, classify_chapter_internal
+    )
+
+async def classify_chapter_async(chapter_ref, refresh=False):
+    if refresh:
+        return await classification_index.cached_classify_async(
+            chapter_ref, INDEX_KIND, MODEL, classify_chapter_internal_async, refresh=True
+        )
+    return await flights.do_async(
+        verse_store.normalize_ref(chapter_ref), classification_index.cached_classify_async,
+        chapter_ref, INDEX_KIND, MODEL, classify_chapter_internal_async
+    )
+
 # -----------------------------
 # Flask route
 # -----------------------------
+# Compiled once here; routes render it by name
+page_cache.use_templates(app, {"index.html": HTML_TEMPLATE})
+
+def render_page(result=None, error=None, chapter=""):
+    with timing.span("render"):
+        return render_template("index.html", result=result, error=error, chapter=chapter)
+
+def page_error(chapter_ref, error):
+    if page_cache.wants_json():
+        return jsonify({"error": str(error)}), page_cache.error_status(error)
+    return render_page(error=str(error), chapter=chapter_ref)
+
+def indexed_page(chapter_ref):
+    return page_cache.indexed_response(
+        chapter_ref, INDEX_KIND, MODEL,
+        lambda result: render_page(result=result, chapter=bible_refs.canonical_ref(chapter_ref))
+    )
+
+# GET /?chapter=Romans+3 is the cacheable form of a classification (add
+# format=json or Accept: application/json for the result without HTML)
 @app.route("/", methods=["GET", "POST"])
 def index():
+    chapter_ref = request.args.get("chapter", "").strip()
+    if request.method == "GET" and chapter_ref:
+        try:
+            response = indexed_page(chapter_ref)
+            if response is None:
+                classify_chapter(chapter_ref)
+                response = indexed_page(chapter_ref)
+            return response
+        except Exception as e:
+            return page_error(chapter_ref, e)
     result = None
     error = None
     if request.method == "POST":
@@ -152,13 +288,45 @@ def index():
             error = "Please enter a chapter reference."
         else:
             try:
-                result = classify_chapter_internal(chapter_ref)
+                result = classify_chapter(chapter_ref, refresh=request.form.get("refresh") == "1")
             except Exception as e:
                 error = str(e)
-    return render_template_string(HTML_TEMPLATE, result=result, error=error)
+    return render_page(result=result, error=error, chapter=chapter_ref)
+
+async def index_async():
+    chapter_ref = request.args.get("chapter", "").strip()
+    if request.method == "GET" and chapter_ref:
+        try:
+            response = indexed_page(chapter_ref)
+            if response is None:
+                await aio.submit(classify_chapter_async(chapter_ref))
+                response = indexed_page(chapter_ref)
+            return response
+        except Exception as e:
+            return page_error(chapter_ref, e)
+    result = None
+    error = None
+    if request.method == "POST":
+        chapter_ref = request.form.get("chapter", "").strip()
+        if not chapter_ref:
+            error = "Please enter a chapter reference."
+        else:
+            try:
+                result = await aio.submit(classify_chapter_async(chapter_ref, refresh=request.form.get("refresh") == "1"))
+            except Exception as e:
+                error = str(e)
+    return render_page(result=result, error=error, chapter=chapter_ref)
+
+# GET /metrics plus per-request timing
+metrics.install(app)
+
+if aio.ASYNC_MODE:
+    app.view_functions["index"] = index_async
 
 # -----------------------------
 # Run server
 # -----------------------------
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=5000, debug=True, use_reloader=False)
+    # Development server only (FLASK_DEBUG=1 turns on the debugger);
+    # use `python serve.py themes` in production
+    app.run(host="127.0.0.1", port=5000, use_reloader=False)
@@ -1,9 +1,27 @@
-from flask import Flask, request, render_template_string
-from groq import Groq
+from flask import Flask, request, render_template, Response, stream_with_context, jsonify
+from groq import Groq, AsyncGroq
 import os
-import requests
+import verse_store
+import bible_refs
+import classification_index
+from single_flight import SingleFlight
+import llm_cache
+import timing
+import aio
+import metrics
+import page_cache
+import llm_json
+import structured_output
+import lesson_ranker
+from lesson_matcher import LessonMatcher
+from prompt_builder import PromptBuilder, estimate_tokens, lesson_ids
 import json
 import re
+import textwrap
+import asyncio
+import contextvars
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 client = Groq(api_key=os.getenv("GROQ_API_KEY"))
@@ -11,14 +29,91 @@ client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 # -----------------------------
 # Bible Chapter Fetch
 # -----------------------------
+FETCH_STATS = {"fetches": 0}
+
 def fetch_bible_chapter(chapter_ref):
-    query = chapter_ref.lower().replace(" ", "+")
-    url = f"https://bible-api.com/{query}"
-    response = requests.get(url)
-    if response.status_code != 200:
-        return None
-    data = response.json()
-    return data.get("verses", [])
+    FETCH_STATS["fetches"] += 1
+    return verse_store.get_chapter(chapter_ref)
+
+# -----------------------------
+# Request-scoped chapter
+# -----------------------------
+WORD_RE = re.compile(r"[a-z0-9]+")
+# "John 3:16", "Jn 3.16", "3:16" (book optional)
+VERSE_REF_RE = re.compile(r"^\s*(?:((?:[1-3]\s*)?[A-Za-z][A-Za-z. ]*?)\s*)?(\d+)\s*[:.]\s*(\d+)\b")
+# "16", "v. 16", "verse 16", "16: For God so loved..."
+VERSE_NUMBER_RE = re.compile(r"^\s*(?:v(?:erse|s)?\.?\s*)?(\d+)\b")
+# A quoted fragment shorter than this could match the wrong verse
+MIN_QUOTE_WORDS = 3
+
+def normalize_verse_text(text):
+    return " ".join(WORD_RE.findall(text.lower()))
+
+class Chapter:
+    """
+    A chapter fetched once per classification and shared by every stage.
+    """
+    def __init__(self, ref, verses, label=None):
+        self.ref = ref
+        self.verses = verses
+        self.verse_index = {str(v['verse']): v['text'] for v in verses}
+        # Normalized verse text -> verse number, for key verses quoted as text
+        self.text_index = {normalize_verse_text(v['text']): str(v['verse']) for v in verses}
+        # How the prompt names it, e.g. "Psalms 119 (verses 1-44)" for a window
+        self.label = label or ref
+
+    def numbered_text(self):
+        return " ".join(f"{v['verse']}: {v['text']}" for v in self.verses)
+
+    def resolve_verse(self, key_verse):
+        """
+        Verse number (as a string) for a key verse given as a number
+        ("16", "v. 16"), a reference ("John 3:16") or quoted text, or None
+        if it does not name a verse of this chapter.
+        """
+        key_verse = str(key_verse or "").strip()
+        ref = VERSE_REF_RE.match(key_verse)
+        if ref:
+            book, chapter_number, verse = ref.groups()
+            own_book, own_number = self.ref.rsplit(" ", 1)
+            try:
+                same_book = not book or bible_refs.find_book(book)[0] == bible_refs.find_book(own_book)[0]
+            except ValueError:
+                same_book = False
+            if same_book and chapter_number == own_number and verse in self.verse_index:
+                return verse
+            return None
+        number = VERSE_NUMBER_RE.match(key_verse)
+        if number and number.group(1) in self.verse_index:
+            return number.group(1)
+        return self._find_quote(key_verse[number.end():] if number else key_verse)
+
+    def _find_quote(self, text):
+        # The model often trims a quote with "..."; match on its longest piece
+        quote = max(re.split(r"\.\.\.|…", text), key=len)
+        quote = normalize_verse_text(quote)
+        if len(quote.split()) < MIN_QUOTE_WORDS:
+            return None
+        if quote in self.text_index:
+            return self.text_index[quote]
+        matches = [number for verse_text, number in self.text_index.items() if quote in verse_text]
+        return matches[0] if len(matches) == 1 else None
+
+def load_chapter(chapter_ref):
+    # Canonical ref ("rom 8" -> "Romans 8") so prompts and cache keys agree
+    chapter_ref = bible_refs.canonical_ref(chapter_ref)
+    verses = fetch_bible_chapter(chapter_ref)
+    if not verses:
+        raise ValueError("Chapter not found.")
+    return Chapter(chapter_ref, verses)
+
+async def load_chapter_async(chapter_ref):
+    chapter_ref = bible_refs.canonical_ref(chapter_ref)
+    FETCH_STATS["fetches"] += 1
+    verses = await verse_store.get_chapter_async(chapter_ref)
+    if not verses:
+        raise ValueError("Chapter not found.")
+    return Chapter(chapter_ref, verses)
 
 # -----------------------------
 # Category Lists
@@ -173,136 +268,132 @@ def format_key_verse(verse_text, chapter_ref):
 # -----------------------------
 # Fix LLM JSON output
 # -----------------------------
+@timing.timed("parse")
 def fix_json(text):
     """
     Safely parse LLM JSON output even if scripture contains quotes.
     """
-    import json
-    import re
-
-    # Normalize smart quotes and apostrophes
-    cleaned = text.replace("“", "'")
-    cleaned = re.sub(r'["“”]\s*(?=\()', '', cleaned)
-    cleaned = re.sub(r'[\"“”]{2}', '"', cleaned)
-    cleaned = re.sub(r'[“”](?=.)', "'", cleaned)
-#   cleaned = cleaned.replace("”", "\"")
-
-#    print("last char = " + cleaned[-1])
-#    if cleaned.endswith("”"):
-#        cleaned = cleaned[:-1] + "\""
-#    else:
-#        cleaned.replace("”", "'")
-
-    # Find all "key": "value" patterns and escape inner quotes
-    def escape_inner_quotes(match):
-        key = match.group(1)
-        value = match.group(2)
-        value = value.replace('\'', '\\"')  # Escape quotes inside the value
-        return f'"{key}": "{value}"'
-
-    # Apply to all key-value pairs
-    cleaned = re.sub(r'"([^"]+)":\s*"([^"]*?)"', escape_inner_quotes, cleaned)
-
-    # Extract JSON object
-    match = re.search(r"\{.*\}", cleaned, re.DOTALL)
-    if not match:
-        raise ValueError("No JSON object found in LLM output.")
-
-    json_text = match.group(0)
-
-    # Parse safely
-    try:
-        return json.loads(json_text)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Invalid JSON after fix:\n{json_text}\n\nError: {e}")
+    return llm_json.loads(text)
 
+# -----------------------------
+# Normalize categories and lessons
+# -----------------------------
+# Built once at import; precedence is Stanley → Doctrine → Growth → Other
+LESSON_MATCHER = LessonMatcher([
+    ("Charles Stanley Life Principles",
+     [(f"Charles Stanley Life Principle {i}", lesson) for i, lesson in enumerate(CHARLES_STANLEY_30, start=1)]),
+    ("Doctrine", [(d, d) for d in DOCTRINE_LIST]),
+    ("Christian Growth", [(g, g) for g in GROWTH_LIST]),
+], fuzzy_cutoff=float(os.getenv("LESSON_FUZZY_CUTOFF", "0.8")))
 
+# Short IDs used by the compact prompt
+LESSON_IDS = lesson_ids([
+    ("S", "Charles Stanley Life Principles",
+     [(f"Charles Stanley Life Principle {i}", lesson) for i, lesson in enumerate(CHARLES_STANLEY_30, start=1)]),
+    ("D", "Doctrine", [(d, d) for d in DOCTRINE_LIST]),
+    ("G", "Christian Growth", [(g, g) for g in GROWTH_LIST]),
+])
 
+def match_lesson(text):
+    return LESSON_IDS.get(text.strip().upper()) or LESSON_MATCHER.match(text)
 
+def pick_category(text):
+    match = match_lesson(text)
+    if match:
+        return match
+    return "Other", text, text
 
+def normalize_lesson(lesson):
+    cat, lesson_name, lesson_text = pick_category(lesson["lesson"])
+    if lesson["lesson"].strip().upper() in LESSON_IDS:
+        lesson["lesson"] = lesson_text
+    lesson["category"] = cat
+    lesson["lesson_name"] = lesson_name
+    lesson["lesson_text"] = lesson_text or lesson["lesson"]
+    return lesson
 
-# -----------------------------
-# Normalize categories and lessons
-# -----------------------------
+@timing.timed("normalize")
 def normalize_categories(result):
-    def pick_category(text):
-        # Stanley 30
-        for i, lesson in enumerate(CHARLES_STANLEY_30, start=1):
-            if lesson.lower() in text.lower():
-                return "Charles Stanley Life Principles", f"Charles Stanley Life Principle {i}", lesson
-        # Doctrine
-        for d in DOCTRINE_LIST:
-            if d.lower() in text.lower():
-                return "Doctrine", d, d
-        # Growth
-        for g in GROWTH_LIST:
-            if g.lower() in text.lower():
-                return "Christian Growth", g, g
-        # Other
-        return "Other", text, text
-
     # Main lesson
-    cat, lesson_name, lesson_text = pick_category(result["main_lesson"]["lesson"])
-    result["main_lesson"]["category"] = cat
-    result["main_lesson"]["lesson_name"] = lesson_name
-    result["main_lesson"]["lesson_text"] = lesson_text or result["main_lesson"]["lesson"]
+    normalize_lesson(result["main_lesson"])
+    seen = {result["main_lesson"]["lesson_name"]}
 
-    # Other lessons
+    # Other lessons; a lesson already given is dropped (rule 2 of the prompt)
+    others = []
     for l in result.get("other_lessons", []):
-        cat, lesson_name, lesson_text = pick_category(l["lesson"])
-        l["category"] = cat
-        l["lesson_name"] = lesson_name
-        l["lesson_text"] = lesson_text or l["lesson"]
+        normalize_lesson(l)
+        if l["lesson_name"] in seen:
+            KEY_VERSE_STATS["duplicate_lessons"] += 1
+            continue
+        seen.add(l["lesson_name"])
+        others.append(l)
+    result["other_lessons"] = others
 
     return result
 
 # -----------------------------
 # Enrich key verses from chapter
 # -----------------------------
-def enrich_key_verses(result, chapter_ref):
-    verses = fetch_bible_chapter(chapter_ref)
-    verse_map = {str(v['verse']): v['text'] for v in verses}
-
-    def format_key_verse(kv):
-        match = re.match(r'(\d+)', kv)
-        if not match:
-            return kv
-        verse_num = match.group(1)
-        text = verse_map.get(verse_num, "")
-        # Escape quotes for JSON safety
-        text = text.replace('"', '\\"')
-        return f"{text} ({chapter_ref}:{verse_num})"
+# The prompt's key-verse rules (the verse is in the chapter, no verse used
+# twice) are enforced here rather than by asking the model again.
+KEY_VERSE_STATS = {"resolved": 0, "unresolved": 0, "duplicates": 0, "promoted": 0, "duplicate_lessons": 0}
 
-    # Main lesson
-    if 'main_lesson' in result:
-        kv = result['main_lesson'].get('key_verse', '')
-        result['main_lesson']['key_verse'] = format_key_verse(kv)
-
-    # Other lessons
-    for lesson in result.get('other_lessons', []):
-        kv = lesson.get('key_verse', '')
-        lesson['key_verse'] = format_key_verse(kv)
+def enrich_lesson(lesson, chapter, used):
+    """
+    Replace the lesson's key verse with its text and reference and add its
+    number to used. Returns None (leaving the lesson as it was) if the key
+    verse is not in the chapter or is already in used.
+    """
+    verse_num = chapter.resolve_verse(lesson.get('key_verse', ''))
+    if verse_num is None:
+        KEY_VERSE_STATS["unresolved"] += 1
+        return None
+    if verse_num in used:
+        KEY_VERSE_STATS["duplicates"] += 1
+        return None
+    KEY_VERSE_STATS["resolved"] += 1
+    used.add(verse_num)
+    # Escape quotes for JSON safety
+    text = chapter.verse_index[verse_num].replace('"', '\\"')
+    lesson['key_verse'] = f"{text} ({chapter.ref}:{verse_num})"
+    return lesson
 
+@timing.timed("enrich")
+def enrich_key_verses(result, chapter):
+    used = set()
+    main = result.get('main_lesson')
+    lessons = [main] + list(result.get('other_lessons', []))
+    # In order, so the main lesson has first claim on its verse
+    valid = [l for l in lessons if isinstance(l, dict) and enrich_lesson(l, chapter, used) is not None]
+    if not valid:
+        # Nothing usable; keep the main lesson as the model gave it
+        result['other_lessons'] = []
+        return result
+    if valid[0] is not main:
+        # The first other lesson with a valid verse takes the main lesson's place
+        KEY_VERSE_STATS["promoted"] += 1
+    result['main_lesson'], result['other_lessons'] = valid[0], valid[1:]
     return result
 
 
 # -----------------------------
 # LLM Classification
 # -----------------------------
-def classify_chapter_internal(chapter_ref):
-    verses = fetch_bible_chapter(chapter_ref)
-    if not verses:
-        raise ValueError("Chapter not found.")
+MODEL = "llama-3.1-8b-instant"
+
+# Compact mode lists lessons by short ID (S1, D12, G3), drops the JSON
+# example and the derivable category field; IDs are mapped back to the
+# full lesson in normalize_categories.
+PROMPT_COMPACT = os.getenv("PROMPT_COMPACT", "") == "1"
 
-    chapter_text = " ".join(f"{v['verse']}: {v['text']}" for v in verses)
-    doctrine_text = "\n".join(DOCTRINE_LIST)
-    growth_text = "\n".join(GROWTH_LIST)
-    stanley_text = "\n".join([f"{i}. {lesson}" for i, lesson in enumerate(CHARLES_STANLEY_30, start=1)])
+# The whole instruction block and taxonomy are static, so they are built
+# once here and placed before the chapter text.
+SYSTEM_PROMPT = "You are a precise theological classifier. Output strict JSON."
 
-    prompt = f"""
+FULL_TEMPLATE = textwrap.dedent("""
     You are a Bible scholar.
 
-    Classify the chapter {chapter_ref} into:
+    Classify the chapter given at the end into:
     - ONE main lesson
     - Up to TWO other lessons
 
@@ -346,30 +437,341 @@ def classify_chapter_internal(chapter_ref):
           }}
       ]
     }}
+""")
+
+COMPACT_TEMPLATE = textwrap.dedent("""
+    You are a Bible scholar. Classify the chapter given at the end.
+    Pick ONE main lesson and up to TWO other lessons by ID from the lists below, each with ONE key verse number from the chapter that explicitly proves it.
+    Rules: prefer S over D over G. Use an S principle only if the chapter clearly teaches it. Never reuse a lesson or a key verse. Leave out a lesson if no verse clearly supports it.
 
-    Chapter text:
-    \"\"\"{chapter_text}\"\"\"
+    S (Charles Stanley Life Principles):
+    {stanley_ids}
+
+    D (Doctrine):
+    {doctrine_ids}
+
+    G (Christian Growth):
+    {growth_ids}
+
+    Return ONLY JSON: {{"main_lesson": {{"lesson": "<ID>", "key_verse": "<verse number>"}}, "other_lessons": [{{"lesson": "<ID>", "key_verse": "<verse number>"}}]}}
+""")
+
+def listed(id_prefix, lessons, keep=None):
+    """
+    (position, lesson) pairs of a taxonomy list, limited to the short IDs
+    in keep (None keeps all). Positions stay those of the full list.
     """
+    return [(i, lesson) for i, lesson in enumerate(lessons, start=1) if keep is None or f"{id_prefix}{i}" in keep]
 
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": "You are a precise theological classifier. Output strict JSON."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0
+def full_prefix(keep=None):
+    return FULL_TEMPLATE.format(
+        doctrine_text="\n".join(d for _, d in listed("D", DOCTRINE_LIST, keep)),
+        growth_text="\n".join(g for _, g in listed("G", GROWTH_LIST, keep)),
+        stanley_text="\n".join(f"{i}. {lesson}" for i, lesson in listed("S", CHARLES_STANLEY_30, keep))
     )
 
-    raw_output = response.choices[0].message.content.strip()
-    result = fix_json(raw_output)
-    result = enrich_key_verses(result, chapter_ref)
+def compact_prefix(keep=None):
+    return COMPACT_TEMPLATE.format(
+        stanley_ids="\n".join(f"S{i} {lesson}" for i, lesson in listed("S", CHARLES_STANLEY_30, keep)),
+        doctrine_ids="\n".join(f"D{i} {d}" for i, d in listed("D", DOCTRINE_LIST, keep)),
+        # Growth entries that repeat a doctrine are dropped; the doctrine wins anyway
+        growth_ids="\n".join(f"G{i} {g}" for i, g in listed("G", GROWTH_LIST, keep) if g not in DOCTRINE_LIST)
+    )
+
+FULL_PROMPT = PromptBuilder(SYSTEM_PROMPT, full_prefix())
+COMPACT_PROMPT = PromptBuilder(SYSTEM_PROMPT, compact_prefix())
+
+# -----------------------------
+# Optional pre-ranking (needs numpy)
+# -----------------------------
+# With LESSON_PRERANK_K set, the prompt lists only the K taxonomy entries
+# closest to the chapter text instead of all ~120, and with VERSE_PRERANK_K
+# only the K verses closest to the top-ranked lessons. The prompt prefix
+# then differs per chapter, so this trades provider prefix caching for a
+# much shorter prompt. 0 (the default) sends everything.
+LESSON_PRERANK_K = int(os.getenv("LESSON_PRERANK_K", "0"))
+VERSE_PRERANK_K = int(os.getenv("VERSE_PRERANK_K", "0"))
+# Verses are ranked against this many of the best lessons
+VERSE_PRERANK_LESSONS = 3
+
+LESSON_RANKER = None
+if LESSON_PRERANK_K > 0:
+    if lesson_ranker.available():
+        LESSON_RANKER = lesson_ranker.LessonRanker([(key, text) for key, (_, _, text) in LESSON_IDS.items()])
+    else:
+        app.logger.warning("LESSON_PRERANK_K is set but numpy is not installed; sending the full lesson lists")
+
+def prompt_parts(chapter):
+    """
+    (prompt builder, chapter text) for a chapter, narrowed by the ranker when it is on.
+    """
+    builder = COMPACT_PROMPT if PROMPT_COMPACT else FULL_PROMPT
+    if LESSON_RANKER is None:
+        return builder, chapter.numbered_text()
+    ranked = LESSON_RANKER.rank(chapter.numbered_text(), LESSON_PRERANK_K)
+    app.logger.debug("Lesson ranking for %s: %s", chapter.label,
+                     ", ".join(f"{key} {score:.3f}" for key, score in ranked))
+    keep = {key for key, _ in ranked}
+    builder = PromptBuilder(SYSTEM_PROMPT, compact_prefix(keep) if PROMPT_COMPACT else full_prefix(keep))
+    verses = chapter.verses
+    if VERSE_PRERANK_K > 0:
+        best = [key for key, _ in ranked[:VERSE_PRERANK_LESSONS]]
+        verses = [verses[i] for i in LESSON_RANKER.rank_verses([v["text"] for v in verses], best, VERSE_PRERANK_K)]
+    return builder, " ".join(f"{v['verse']}: {v['text']}" for v in verses)
+
+@timing.timed("prompt")
+def build_messages(chapter):
+    builder, chapter_text = prompt_parts(chapter)
+    suffix = f"""
+Chapter: {chapter.label}
+
+Chapter text:
+\"\"\"{chapter_text}\"\"\"
+"""
+    messages = builder.build(suffix)
+    app.logger.debug("Prompt for %s: ~%d tokens (%d static prefix)",
+                     chapter.label, estimate_tokens(messages[0]["content"] + messages[1]["content"]),
+                     builder.prefix_tokens)
+    return messages
+
+def finish_classification(result, chapter):
+    result = enrich_key_verses(result, chapter)
     result = normalize_categories(result)
     return result
 
+# -----------------------------
+# Structured-output classification
+# -----------------------------
+ALLOWED_LESSONS = list(dict.fromkeys(CHARLES_STANLEY_30 + DOCTRINE_LIST + GROWTH_LIST))
+LESSON_CATEGORIES = ["Charles Stanley 30 Life Principles", "Doctrine", "Christian Growth"]
+
+def structured_request(chapter):
+    item = structured_output.item_schema(
+        "lesson", list(LESSON_IDS) if PROMPT_COMPACT else ALLOWED_LESSONS,
+        allowed_verses=list(chapter.verse_index),
+        extra={"category": {"type": "string", "enum": LESSON_CATEGORIES}}
+    )
+    schema = structured_output.result_schema("main_lesson", "other_lessons", item, max_items=2)
+
+    def is_valid(lesson):
+        # A verse quoted as text or as a reference is fixed locally, not re-asked
+        return (
+            match_lesson(str(lesson.get("lesson", ""))) is not None
+            and chapter.resolve_verse(lesson.get("key_verse", "")) is not None
+        )
+
+    return dict(
+        messages=build_messages(chapter),
+        name="chapter_lessons",
+        schema=schema,
+        main_key="main_lesson",
+        list_key="other_lessons",
+        item=item,
+        is_valid=is_valid,
+        problem="Each lesson must come from the category lists and its key_verse must be a verse number from this chapter."
+    )
+
+def classify_result(chapter):
+    """
+    Raw lesson result for one chapter (or window), before enrichment.
+    """
+    if structured_output.enabled():
+        def complete(messages, response_format):
+            return llm_cache.cached_completion(
+                client, model=MODEL, messages=messages, temperature=0, response_format=response_format,
+                parse=structured_output.json_text
+            )
+        return structured_output.classify(complete, **structured_request(chapter))
+
+    # Parsed before caching, so an answer fix_json rejects is asked for again next time
+    return llm_cache.cached_completion(
+        client,
+        model=MODEL,
+        messages=build_messages(chapter),
+        temperature=0,
+        parse=fix_json
+    )
+
+async def classify_result_async(chapter):
+    async_client = aio.shared("groq", lambda: AsyncGroq(api_key=os.getenv("GROQ_API_KEY")))
+    if structured_output.enabled():
+        async def complete(messages, response_format):
+            return await llm_cache.cached_completion_async(
+                async_client, model=MODEL, messages=messages, temperature=0, response_format=response_format,
+                parse=structured_output.json_text
+            )
+        return await structured_output.classify_async(complete, **structured_request(chapter))
+
+    return await llm_cache.cached_completion_async(
+        async_client,
+        model=MODEL,
+        messages=build_messages(chapter),
+        temperature=0,
+        parse=fix_json
+    )
+
+# -----------------------------
+# Long chapters: map-reduce over verse windows
+# -----------------------------
+# Chapters whose text is estimated above LONG_CHAPTER_TOKENS (e.g. Psalm 119)
+# are split into windows of at most WINDOW_TOKENS, classified in parallel,
+# and the lesson / key-verse votes are merged back into one result.
+LONG_CHAPTER_TOKENS = int(os.getenv("LONG_CHAPTER_TOKENS", "2500"))
+WINDOW_TOKENS = int(os.getenv("WINDOW_TOKENS", "1200"))
+window_pool = ThreadPoolExecutor(max_workers=int(os.getenv("WINDOW_WORKERS", "4")))
+
+def split_windows(chapter):
+    if estimate_tokens(chapter.numbered_text()) <= LONG_CHAPTER_TOKENS:
+        return [chapter]
+    windows, current, size = [], [], 0
+    for v in chapter.verses:
+        tokens = estimate_tokens(f"{v['verse']}: {v['text']} ")
+        if current and size + tokens > WINDOW_TOKENS:
+            windows.append(current)
+            current, size = [], 0
+        current.append(v)
+        size += tokens
+    if current:
+        windows.append(current)
+    return [
+        Chapter(chapter.ref, verses, label=f"{chapter.ref} (verses {verses[0]['verse']}-{verses[-1]['verse']})")
+        for verses in windows
+    ]
+
+def merge_window_results(results):
+    """
+    Vote across window results: a main lesson counts 2, an other lesson 1.
+    The winning lessons keep the key verse most often chosen for them,
+    never reusing a verse.
+    """
+    votes = {}
+    for result in results:
+        lessons = [(result.get("main_lesson"), 2)] + [(l, 1) for l in result.get("other_lessons", [])]
+        for lesson, weight in lessons:
+            if not isinstance(lesson, dict) or not lesson.get("lesson"):
+                continue
+            _, lesson_name, lesson_text = pick_category(str(lesson["lesson"]))
+            entry = votes.setdefault(lesson_name, {"lesson": lesson_text, "score": 0, "verses": {}})
+            entry["score"] += weight
+            verse = re.match(r'\s*(\d+)', str(lesson.get("key_verse", "")))
+            if verse:
+                entry["verses"][verse.group(1)] = entry["verses"].get(verse.group(1), 0) + weight
+
+    ranked = sorted(votes.values(), key=lambda e: e["score"], reverse=True)
+    merged, used_verses = [], set()
+    for entry in ranked:
+        verses = [v for v in sorted(entry["verses"], key=entry["verses"].get, reverse=True) if v not in used_verses]
+        if not verses:
+            continue
+        used_verses.add(verses[0])
+        merged.append({"lesson": entry["lesson"], "key_verse": verses[0]})
+        if len(merged) == 3:
+            break
+    if not merged:
+        raise ValueError("No lesson could be found in any part of the chapter.")
+    return {"main_lesson": merged[0], "other_lessons": merged[1:]}
+
+def pin_key_verses(result, window):
+    """
+    Key verses as bare verse numbers ("" if not in the window), resolved
+    against the window the model saw, so windows can be merged by number.
+    """
+    for lesson in [result.get("main_lesson")] + list(result.get("other_lessons", [])):
+        if isinstance(lesson, dict):
+            lesson["key_verse"] = window.resolve_verse(lesson.get("key_verse", "")) or ""
+    return result
+
+def classify_windows(windows):
+    # Run each window in a copy of the caller's context (e.g. a cache refresh)
+    futures = [window_pool.submit(contextvars.copy_context().run, classify_result, window) for window in windows]
+    results, errors = [], []
+    for window, future in zip(windows, futures):
+        try:
+            results.append(pin_key_verses(future.result(), window))
+        except Exception as e:
+            errors.append(e)
+    if not results:
+        raise errors[0]
+    return merge_window_results(results)
+
+async def classify_windows_async(windows):
+    outcomes = await asyncio.gather(*(classify_result_async(w) for w in windows), return_exceptions=True)
+    results = [pin_key_verses(r, w) for r, w in zip(outcomes, windows) if not isinstance(r, BaseException)]
+    if not results:
+        raise outcomes[0]
+    return merge_window_results(results)
+
+def classify_chapter_internal(chapter_ref):
+    chapter = load_chapter(chapter_ref)
+    windows = split_windows(chapter)
+    if len(windows) > 1:
+        result = classify_windows(windows)
+    else:
+        result = classify_result(chapter)
+    return finish_classification(result, chapter)
+
+async def classify_chapter_internal_async(chapter_ref):
+    chapter = await load_chapter_async(chapter_ref)
+    windows = split_windows(chapter)
+    if len(windows) > 1:
+        result = await classify_windows_async(windows)
+    else:
+        result = await classify_result_async(chapter)
+    return finish_classification(result, chapter)
+
+# -----------------------------
+# Index-first classification
+# -----------------------------
+# Chapters precomputed by precompute_canon.py are served straight from the
+# classification index; refresh=True reclassifies and overwrites the entry.
+INDEX_KIND = "doctrine"
+
+# Concurrent requests for the same chapter share one fetch and LLM call;
+# a forced refresh always runs on its own
+flights = SingleFlight()
+
+def classify_chapter(chapter_ref, refresh=False):
+    if refresh:
+        return classification_index.cached_classify(
+            chapter_ref, INDEX_KIND, MODEL, classify_chapter_internal, refresh=True
+        )
+    return flights.do(
+        verse_store.normalize_ref(chapter_ref), classification_index.cached_classify,
+        chapter_ref, INDEX_KIND, MODEL, classify_chapter_internal
+    )
+
+async def classify_chapter_async(chapter_ref, refresh=False):
+    if refresh:
+        return await classification_index.cached_classify_async(
+            chapter_ref, INDEX_KIND, MODEL, classify_chapter_internal_async, refresh=True
+        )
+    return await flights.do_async(
+        verse_store.normalize_ref(chapter_ref), classification_index.cached_classify_async,
+        chapter_ref, INDEX_KIND, MODEL, classify_chapter_internal_async
+    )
+
 # -----------------------------
 # HTML Template
 # -----------------------------
-HTML_TEMPLATE = """
+CARD_MACRO = """
+{% macro card(l, title, heading) %}
+<div class="card">
+  <p>Category:
+    {% if l.category == "Charles Stanley Life Principles" %}
+      <span class="Charles_Stanley">{{ l.lesson_name }}</span>
+    {% else %}
+      <span class="{{ l.category.replace(' ', '_') }}">{{ l.category }}</span>
+    {% endif %}
+  </p>
+  <{{ heading }}>{{ title }}: {{ l.lesson_text }}</{{ heading }}>
+  <p><strong>Key Verse:</strong> {{ l.key_verse }}</p>
+</div>
+{% endmacro %}
+"""
+
+CARD_TEMPLATE = CARD_MACRO + "{{ card(l, title, heading) }}"
+
+HTML_TEMPLATE = CARD_MACRO + """
 <!doctype html>
 <html>
 <head>
@@ -386,59 +788,311 @@ HTML_TEMPLATE = """
 <body>
 <h1>Bible Chapter Classifier</h1>
 
-<form method="post">
-  Chapter: <input type="text" name="chapter" value="{{ request.form.get('chapter','') }}">
+<form method="post" id="classify-form">
+  Chapter: <input type="text" name="chapter" value="{{ chapter }}">
+  <label><input type="checkbox" name="refresh" value="1"> Reclassify</label>
   <input type="submit" value="Classify">
 </form>
 
+<div id="results">
 {% if error %}
 <p style="color:red;">{{ error }}</p>
 {% endif %}
 
 {% if result %}
-<div class="card">
-  <p>Category:
-    {% if result.main_lesson.category == "Charles Stanley Life Principles" %}
-      <span class="Charles_Stanley">{{ result.main_lesson.lesson_name }}</span>
-    {% else %}
-      <span class="{{ result.main_lesson.category.replace(' ', '_') }}">{{ result.main_lesson.category }}</span>
-    {% endif %}
-  </p>
-  <h3>Main Lesson: {{ result.main_lesson.lesson_text }}</h3>
-  <p><strong>Key Verse:</strong> {{ result.main_lesson.key_verse }}</p>
-</div>
+{{ card(result.main_lesson, "Main Lesson", "h3") }}
 
 {% for l in result.other_lessons %}
-<div class="card">
-  <p>Category:
-    {% if l.category == "Charles Stanley Life Principles" %}
-      <span class="Charles_Stanley">{{ l.lesson_name }}</span>
-    {% else %}
-      <span class="{{ l.category.replace(' ', '_') }}">{{ l.category }}</span>
-    {% endif %}
-  </p>
-  <h4>Other Lesson: {{ l.lesson_text }}</h4>
-  <p><strong>Key Verse:</strong> {{ l.key_verse }}</p>
-</div>
+{{ card(l, "Other Lesson", "h4") }}
 {% endfor %}
 {% endif %}
+</div>
+
+<script>
+// Progressive mode: show each card as soon as it is parsed from the token
+// stream. Without EventSource the form posts normally.
+if (window.EventSource) {
+  document.getElementById("classify-form").addEventListener("submit", function (e) {
+    e.preventDefault();
+    var chapter = this.elements.chapter.value;
+    var results = document.getElementById("results");
+    results.innerHTML = "<p><em>Classifying " + chapter.replace(/</g, "&lt;") + "…</em></p>";
+    var refresh = this.elements.refresh.checked ? "&refresh=1" : "";
+    var source = new EventSource("{{ url_for('stream') }}?chapter=" + encodeURIComponent(chapter) + refresh);
+    source.addEventListener("lesson", function (ev) {
+      var status = results.querySelector("em");
+      if (status) { status.parentNode.remove(); }
+      results.insertAdjacentHTML("beforeend", ev.data);
+    });
+    source.addEventListener("failed", function (ev) {
+      results.innerHTML = '<p style="color:red;"></p>';
+      results.firstChild.textContent = ev.data;
+      source.close();
+    });
+    source.addEventListener("done", function () { source.close(); });
+    source.onerror = function () { source.close(); };
+  });
+}
+</script>
 </body>
 </html>
 """
 
+# Compiled once here; routes render them by name
+page_cache.use_templates(app, {"index.html": HTML_TEMPLATE, "card.html": CARD_TEMPLATE})
+
+def render_page(result=None, error=None, chapter=""):
+    with timing.span("render"):
+        return render_template("index.html", result=result, error=error, chapter=chapter)
+
+def page_error(chapter, error):
+    if page_cache.wants_json():
+        return jsonify({"error": str(error)}), page_cache.error_status(error)
+    return render_page(error=str(error), chapter=chapter)
+
+def indexed_page(chapter):
+    return page_cache.indexed_response(
+        chapter, INDEX_KIND, MODEL,
+        lambda result: render_page(result=result, chapter=bible_refs.canonical_ref(chapter))
+    )
+
 # -----------------------------
+# GET /?chapter=Romans+8 is the cacheable form of a classification (add
+# format=json or Accept: application/json for the result without HTML);
+# POST is the form, and its Reclassify box forces a fresh answer.
 @app.route("/", methods=["GET", "POST"])
 def index():
+    chapter = request.args.get("chapter", "").strip()
+    if request.method == "GET" and chapter:
+        try:
+            response = indexed_page(chapter)
+            if response is None:
+                classify_chapter(chapter)
+                response = indexed_page(chapter)
+            return response
+        except Exception as e:
+            return page_error(chapter, e)
+    result = None
+    error = None
+    if request.method == "POST":
+        chapter = request.form.get("chapter", "").strip()
+        try:
+            result = classify_chapter(chapter, refresh=request.form.get("refresh") == "1")
+        except Exception as e:
+            error = str(e)
+    return render_page(result=result, error=error, chapter=chapter)
+
+async def index_async():
+    chapter = request.args.get("chapter", "").strip()
+    if request.method == "GET" and chapter:
+        try:
+            response = indexed_page(chapter)
+            if response is None:
+                await aio.submit(classify_chapter_async(chapter))
+                response = indexed_page(chapter)
+            return response
+        except Exception as e:
+            return page_error(chapter, e)
     result = None
     error = None
     if request.method == "POST":
         chapter = request.form.get("chapter", "").strip()
         try:
-            result = classify_chapter_internal(chapter)
+            result = await aio.submit(classify_chapter_async(chapter, refresh=request.form.get("refresh") == "1"))
         except Exception as e:
             error = str(e)
-    return render_template_string(HTML_TEMPLATE, result=result, error=error)
+    return render_page(result=result, error=error, chapter=chapter)
+
+# -----------------------------
+# Progressive results (server-sent events)
+# -----------------------------
+def sse(event, data):
+    lines = "\n".join(f"data: {line}" for line in str(data).splitlines() or [""])
+    return f"event: {event}\n{lines}\n\n"
+
+def result_cards(result):
+    """
+    SSE messages for a finished classification, all cards at once.
+    """
+    yield sse("lesson", render_template("card.html", l=result["main_lesson"], title="Main Lesson", heading="h3").strip())
+    for lesson in result.get("other_lessons", []):
+        yield sse("lesson", render_template("card.html", l=lesson, title="Other Lesson", heading="h4").strip())
+    yield sse("done", "")
+
+def stream_lesson_cards(chapter_ref, refresh=False):
+    """
+    Yield SSE messages: one rendered card per lesson as soon as that lesson's
+    JSON object is complete in the token stream, then a final "done".
+    Concurrent streams (and classify_chapter calls) for the same chapter
+    share one flight: only the leader streams, the others get its finished
+    cards together.
+    """
+    # Flush something right away so the browser sees the response start
+    yield ": classifying\n\n"
+    flight = None
+    try:
+        indexed = None if refresh else classification_index.lookup(chapter_ref, INDEX_KIND, MODEL)
+        if indexed is not None:
+            yield from result_cards(indexed)
+            return
+        if not refresh:
+            key = verse_store.normalize_ref(chapter_ref)
+            future, leader = flights.claim(key)
+            if not leader:
+                yield from result_cards(flights.wait(future))
+                return
+            flight = (key, future)
+            # The previous leader may have stored the chapter since the lookup
+            indexed = classification_index.lookup(chapter_ref, INDEX_KIND, MODEL)
+            if indexed is not None:
+                flights.finish(key, future, result=indexed)
+                yield from result_cards(indexed)
+                return
+        chapter = load_chapter(chapter_ref)
+        parser = llm_json.StreamParser()
+        main_card = None
+        # A main lesson whose key verse is not in the chapter waits here; the
+        # first valid other lesson replaces it, as in enrich_key_verses
+        rejected_main = None
+        other_cards = []
+        sent_others = 0
+        used_verses, seen_lessons = set(), set()
+
+        def card(lesson):
+            nonlocal main_card
+            lesson = normalize_lesson(lesson)
+            if lesson["lesson_name"] in seen_lessons:
+                KEY_VERSE_STATS["duplicate_lessons"] += 1
+                return
+            seen_lessons.add(lesson["lesson_name"])
+            if main_card is None:
+                main_card = lesson
+                yield sse("lesson", render_template("card.html", l=lesson, title="Main Lesson", heading="h3").strip())
+            else:
+                other_cards.append(lesson)
+                yield sse("lesson", render_template("card.html", l=lesson, title="Other Lesson", heading="h4").strip())
+
+        def new_cards(partial):
+            nonlocal rejected_main, sent_others
+            if not isinstance(partial, dict):
+                return
+            main = partial.get("main_lesson")
+            if main_card is None and rejected_main is None and isinstance(main, dict):
+                if enrich_lesson(main, chapter, used_verses) is None:
+                    rejected_main = main
+                else:
+                    yield from card(main)
+            others = partial.get("other_lessons")
+            if (main_card is not None or rejected_main is not None) and isinstance(others, list):
+                for lesson in others[sent_others:]:
+                    sent_others += 1
+                    if isinstance(lesson, dict) and "lesson" in lesson and enrich_lesson(lesson, chapter, used_verses) is not None:
+                        if main_card is None:
+                            KEY_VERSE_STATS["promoted"] += 1
+                        yield from card(lesson)
+
+        with llm_cache.refreshing() if refresh else contextlib.nullcontext():
+            windows = split_windows(chapter)
+            if len(windows) > 1:
+                # Windows are merged only once all of them are back, so there is
+                # nothing to stream early; send the merged cards together
+                yield from new_cards(classify_windows(windows))
+            else:
+                # Only a stream fix_json accepts is cached
+                stream = llm_cache.stream_completion(
+                    client, model=MODEL, messages=build_messages(chapter), temperature=0, parse=fix_json
+                )
+                for piece in stream:
+                    yield from new_cards(parser.feed(piece))
+                yield from new_cards(parser.close())
+            if main_card is None and rejected_main is not None:
+                # No lesson had a valid verse; show the main lesson as given
+                yield from card(rejected_main)
+        if main_card is None:
+            raise ValueError("No lessons were found for this chapter.")
+        # The cards were finished one by one; store the same lessons in the index
+        result = {"main_lesson": main_card, "other_lessons": other_cards}
+        classification_index.store(chapter_ref, INDEX_KIND, MODEL, result)
+        if flight is not None:
+            flights.finish(*flight, result=result)
+        yield sse("done", "")
+    except Exception as e:
+        if flight is not None and not flight[1].done():
+            flights.finish(*flight, error=e)
+        yield sse("failed", str(e))
+    finally:
+        # The browser went away mid-stream: release the waiters
+        if flight is not None and not flight[1].done():
+            flights.finish(*flight, error=RuntimeError("The request classifying this chapter was cancelled. Please try again."))
+
+@app.route("/stream")
+def stream():
+    chapter = request.args.get("chapter", "").strip()
+    return Response(
+        stream_with_context(stream_lesson_cards(chapter, refresh=request.args.get("refresh") == "1")),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# -----------------------------
+# Reverse lookup: which chapters teach a lesson
+# -----------------------------
+MAX_PER_PAGE = 100
+# Lesson names such as "Charles Stanley Life Principle 8" never occur in
+# lesson text, so they are looked up directly
+def lesson_names(entries):
+    # A name listed in more than one tier (e.g. "Faith") keeps the first,
+    # the tier the matcher gives precedence to
+    names = {}
+    for category, name, text in entries:
+        names.setdefault(name.lower(), (category, name, text))
+    return names
+
+LESSON_NAMES = lesson_names(LESSON_MATCHER.entries)
+
+@app.route("/chapters_by_lesson")
+def chapters_by_lesson():
+    """
+    GET /chapters_by_lesson?lesson=Justification&page=1&per_page=20[&role=main]
+    lesson may be a lesson name, its full text, or a short ID such as S8.
+    """
+    query = request.args.get("lesson", "").strip()
+    if not query:
+        return jsonify({"error": "Missing 'lesson' parameter"}), 400
+    try:
+        page = max(1, int(request.args.get("page", "1")))
+        per_page = min(MAX_PER_PAGE, max(1, int(request.args.get("per_page", "20"))))
+    except ValueError:
+        return jsonify({"error": "page and per_page must be integers"}), 400
+    role = request.args.get("role") or None
+    if role not in (None, "main", "other"):
+        return jsonify({"error": "role must be 'main' or 'other'"}), 400
+
+    category, lesson_name, lesson_text = LESSON_NAMES.get(query.lower()) or pick_category(query)
+    total, chapters = classification_index.chapters_by_lesson(
+        INDEX_KIND, lesson_name, page=page, per_page=per_page, role=role
+    )
+    return jsonify({
+        "lesson_name": lesson_name,
+        "lesson_text": lesson_text,
+        "category": category,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "chapters": chapters
+    })
+
+# GET /metrics plus per-request timing
+metrics.install(app, extra=[
+    ("chapter_fetches_total", "Chapter loads requested by the doctrine app", FETCH_STATS, "kind"),
+    ("key_verses_total", "LLM key verses resolved, rejected or deduplicated locally", KEY_VERSE_STATS, "event")
+])
+
+if aio.ASYNC_MODE:
+    app.view_functions["index"] = index_async
 
 # -----------------------------
 if __name__ == "__main__":
-    app.run(debug=True, use_reloader=False)
+    # Development server only (FLASK_DEBUG=1 turns on the debugger);
+    # use `python serve.py doctrine` in production
+    app.run(use_reloader=False)
@@ -1,7 +1,17 @@
-from flask import Flask, request, jsonify
-from groq import Groq
+from flask import Flask, request, jsonify, Response
+from groq import Groq, AsyncGroq
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-import requests
+import json
+import asyncio
+import verse_store
+import bible_refs
+import llm_cache
+import llm_scheduler
+import bible_fetch
+import timing
+import aio
+import metrics
 
 app = Flask(__name__)
 
@@ -14,31 +24,16 @@ client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 # Bible chapter fetcher
 # -----------------------------
 def fetch_bible_chapter(chapter_ref):
-    query = chapter_ref.lower().replace(" ", "+")
-    url = f"https://bible-api.com/{query}"
-    response = requests.get(url)
-    if response.status_code != 200:
-        return None
-    data = response.json()
-    verses = data.get("verses", [])
-    return verses  # list of dicts: {"verse": 1, "text": "..."} 
+    verses = verse_store.get_chapter(chapter_ref)
+    return verses  # list of dicts: {"verse": 1, "text": "..."}
 
 # -----------------------------
-# Flask route
+# Chapter classification
 # -----------------------------
-@app.route("/classify_chapter", methods=["POST"])
-def classify_chapter():
-    data = request.get_json()
-    if not data or "chapter" not in data:
-        return jsonify({"error": "Missing 'chapter' field"}), 400
-
-    chapter_ref = data["chapter"].strip()
-
-    # 1️⃣ Fetch chapter verses
-    verses_data = fetch_bible_chapter(chapter_ref)
-    if not verses_data:
-        return jsonify({"error": f"Could not find chapter: {chapter_ref}"}), 404
+MODEL = "llama-3.1-8b-instant"
 
+@timing.timed("prompt")
+def build_messages(verses_data):
     # Combine all verses for LLM
     chapter_text = " ".join(v["text"] for v in verses_data)
 
@@ -90,23 +85,177 @@ Chapter:
 \"\"\"
 """
 
+    return [
+        {"role": "system", "content": "You are a precise theological classifier."},
+        {"role": "user", "content": prompt}
+    ]
+
+@timing.timed("parse")
+def check_output(output):
+    """
+    The model's answer, stripped, once it is known to be JSON; checked
+    before caching so a malformed answer is asked for again next time.
+    """
+    output = output.strip()
+    try:
+        json.loads(output)
+    except ValueError:
+        raise ValueError(f"LLM did not return valid JSON:\n{output}") from None
+    return output
+
+def classify_chapter_internal(chapter_ref):
+    # 1️⃣ Fetch chapter verses
+    verses_data = fetch_bible_chapter(chapter_ref)
+    if not verses_data:
+        raise ValueError(f"Could not find chapter: {chapter_ref}")
+
     # 4️⃣ LLM call
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": "You are a precise theological classifier."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0
+    output = llm_cache.cached_completion(
+        client,
+        model=MODEL,
+        messages=build_messages(verses_data),
+        temperature=0,
+        parse=check_output
     )
 
-    output = response.choices[0].message.content.strip()
-
     # 5️⃣ Return JSON (LLM returns JSON string)
     return output
 
+async def classify_chapter_internal_async(chapter_ref):
+    verses_data = await verse_store.get_chapter_async(chapter_ref)
+    if not verses_data:
+        raise ValueError(f"Could not find chapter: {chapter_ref}")
+
+    output = await llm_cache.cached_completion_async(
+        aio.shared("groq", lambda: AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))),
+        model=MODEL,
+        messages=build_messages(verses_data),
+        temperature=0,
+        parse=check_output
+    )
+    return output
+
+# -----------------------------
+# Flask routes
+# -----------------------------
+@app.route("/classify_chapter", methods=["POST"])
+def classify_chapter():
+    data = request.get_json()
+    if not data or "chapter" not in data:
+        return jsonify({"error": "Missing 'chapter' field"}), 400
+
+    chapter_ref = data["chapter"].strip()
+    try:
+        return classify_chapter_internal(chapter_ref)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except (llm_scheduler.LLMBusyError, bible_fetch.UpstreamError) as e:
+        return jsonify({"error": str(e)}), 503
+
+async def classify_chapter_async():
+    data = request.get_json()
+    if not data or "chapter" not in data:
+        return jsonify({"error": "Missing 'chapter' field"}), 400
+
+    chapter_ref = data["chapter"].strip()
+    try:
+        return await aio.submit(classify_chapter_internal_async(chapter_ref))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except (llm_scheduler.LLMBusyError, bible_fetch.UpstreamError) as e:
+        return jsonify({"error": str(e)}), 503
+
+# Shared by every batch request so the total number of in-flight
+# fetch + LLM calls stays bounded
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+BATCH_MAX_CHAPTERS = int(os.getenv("BATCH_MAX_CHAPTERS", "200"))
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+# Async mode runs batch items on the shared event loop instead
+batch_semaphore = asyncio.Semaphore(BATCH_WORKERS)
+
+def expand_batch_request(data):
+    """
+    Turn {"chapters": [...]} and/or {"book": "Psalms"} into a list of
+    canonical chapter refs. Ranges such as "Romans 5-8" are expanded and
+    repeats dropped; an invalid ref raises ValueError before any work starts.
+    """
+    refs = []
+    for c in data.get("chapters", []):
+        if str(c).strip():
+            refs.extend(bible_refs.parse_ref(str(c)))
+    book = str(data.get("book", "")).strip()
+    if book:
+        name, count = bible_refs.find_book(book)
+        refs.extend(f"{name} {chapter}" for chapter in range(1, count + 1))
+    return list(dict.fromkeys(refs))
+
+def classify_batch_item(index, chapter_ref):
+    # Whole-book requests queue behind single-chapter ones for the LLM
+    try:
+        with llm_scheduler.lane("batch"):
+            output = classify_chapter_internal(chapter_ref)
+    except Exception as e:
+        return {"index": index, "chapter": chapter_ref, "error": str(e)}
+    return batch_item_result(index, chapter_ref, output)
+
+async def classify_batch_item_async(index, chapter_ref):
+    async with batch_semaphore:
+        try:
+            with llm_scheduler.lane("batch"):
+                output = await classify_chapter_internal_async(chapter_ref)
+        except Exception as e:
+            return {"index": index, "chapter": chapter_ref, "error": str(e)}
+    return batch_item_result(index, chapter_ref, output)
+
+def batch_item_result(index, chapter_ref, output):
+    try:
+        return {"index": index, "chapter": chapter_ref, "result": json.loads(output)}
+    except ValueError:
+        return {"index": index, "chapter": chapter_ref, "error": "LLM did not return valid JSON", "raw": output}
+
+@app.route("/classify_batch", methods=["POST"])
+def classify_batch():
+    """
+    Expects JSON: {"chapters": ["Romans 8", "John 3"]} or {"book": "Psalms"}
+    Streams one JSON line per chapter (NDJSON) in completion order.
+    """
+    data = request.get_json()
+    if not data or not (data.get("chapters") or data.get("book")):
+        return jsonify({"error": "Provide a 'chapters' list or a 'book'"}), 400
+
+    try:
+        refs = expand_batch_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if len(refs) > BATCH_MAX_CHAPTERS:
+        return jsonify({"error": f"At most {BATCH_MAX_CHAPTERS} chapters per batch"}), 400
+
+    if aio.ASYNC_MODE:
+        futures = [aio.spawn(classify_batch_item_async(i, ref)) for i, ref in enumerate(refs)]
+    else:
+        futures = [batch_pool.submit(classify_batch_item, i, ref) for i, ref in enumerate(refs)]
+
+    def generate():
+        try:
+            for future in as_completed(futures):
+                yield json.dumps(future.result()) + "\n"
+        finally:
+            # Client went away: drop whatever has not started yet
+            for future in futures:
+                future.cancel()
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+# GET /metrics plus per-request timing
+metrics.install(app)
+
+if aio.ASYNC_MODE:
+    app.view_functions["classify_chapter"] = classify_chapter_async
+
 # -----------------------------
 # Run the server
 # -----------------------------
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=5000, debug=True, use_reloader=False)
+    # Development server only (FLASK_DEBUG=1 turns on the debugger);
+    # use `python serve.py category` in production
+    app.run(host="127.0.0.1", port=5000, use_reloader=False)
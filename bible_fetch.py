@@ -0,0 +1,122 @@
+import os
+import random
+import asyncio
+import requests
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import aio
+
+# -----------------------------
+# Settings
+# -----------------------------
+BIBLE_API_URL = os.getenv("BIBLE_API_URL", "https://bible-api.com").rstrip("/")
+CONNECT_TIMEOUT = float(os.getenv("BIBLE_API_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("BIBLE_API_READ_TIMEOUT", "10"))
+# Upper bound on simultaneous connections to bible-api.com per process
+MAX_CONNECTIONS = int(os.getenv("BIBLE_API_MAX_CONNECTIONS", "10"))
+MAX_RETRIES = int(os.getenv("BIBLE_API_RETRIES", "3"))
+BACKOFF = float(os.getenv("BIBLE_API_BACKOFF", "0.5"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+UPSTREAM_MESSAGE = "The Bible text service is not responding right now. Please try again in a minute."
+
+class UpstreamError(RuntimeError):
+    """
+    bible-api.com could not be reached, or still failed after the retries.
+    An unknown reference is not an error: the fetch returns None.
+    """
+    def __init__(self, message=UPSTREAM_MESSAGE):
+        super().__init__(message)
+
+# -----------------------------
+# Pooled keep-alive session
+# -----------------------------
+def _make_session():
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=("GET",),
+        respect_retry_after_header=True
+    )
+    # pool_block makes extra threads wait for a free connection
+    # instead of opening more than MAX_CONNECTIONS
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=MAX_CONNECTIONS,
+        pool_block=True,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+session = _make_session()
+
+def _reset_after_fork():
+    # Pooled keep-alive sockets belong to the parent process
+    global session
+    session = _make_session()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _chapter_url(chapter_ref):
+    query = chapter_ref.replace(" ", "+")
+    return f"{BIBLE_API_URL}/{query}"
+
+def fetch_chapter(chapter_ref):
+    """
+    Fetch a chapter's verses from bible-api.com. Returns None if the
+    reference is unknown upstream; raises UpstreamError if the service
+    is down, times out or keeps failing.
+    """
+    try:
+        response = session.get(_chapter_url(chapter_ref), timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    except requests.RequestException as e:
+        # Includes RetryError once the adapter has used up its retries
+        raise UpstreamError() from e
+    if response.status_code in RETRY_STATUSES:
+        raise UpstreamError()
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    return data.get("verses", [])
+
+# -----------------------------
+# Async client
+# -----------------------------
+def _make_async_client():
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+    )
+
+async def fetch_chapter_async(chapter_ref):
+    """
+    Same as fetch_chapter, with the adapter's retries done here.
+    """
+    http = aio.shared("http", _make_async_client)
+    url = _chapter_url(chapter_ref)
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = await http.get(url)
+        except httpx.TransportError as e:
+            # Connect and read timeouts, refused connections
+            if attempt == MAX_RETRIES:
+                raise UpstreamError() from e
+            retry_after = ""
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                break
+            if attempt == MAX_RETRIES:
+                raise UpstreamError()
+            retry_after = response.headers.get("Retry-After", "")
+        delay = float(retry_after) if retry_after.isdigit() else BACKOFF * (2 ** attempt)
+        await asyncio.sleep(delay + random.uniform(0, BACKOFF))
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    return data.get("verses", [])
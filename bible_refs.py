@@ -0,0 +1,163 @@
+import re
+
+# -----------------------------
+# Book table
+# -----------------------------
+# Book name, chapter count and common abbreviations for the whole
+# Protestant canon (1,189 chapters), in canonical order.
+BOOKS = [
+    ("Genesis", 50, ["gen", "ge", "gn"]),
+    ("Exodus", 40, ["exod", "exo", "ex"]),
+    ("Leviticus", 27, ["lev", "le", "lv"]),
+    ("Numbers", 36, ["num", "nu", "nm", "nb"]),
+    ("Deuteronomy", 34, ["deut", "dt"]),
+    ("Joshua", 24, ["josh", "jos", "jsh"]),
+    ("Judges", 21, ["judg", "jdg", "jg"]),
+    ("Ruth", 4, ["rth", "ru"]),
+    ("1 Samuel", 31, ["1 sam", "1 sa", "1 sm"]),
+    ("2 Samuel", 24, ["2 sam", "2 sa", "2 sm"]),
+    ("1 Kings", 22, ["1 kgs", "1 ki"]),
+    ("2 Kings", 25, ["2 kgs", "2 ki"]),
+    ("1 Chronicles", 29, ["1 chron", "1 chr", "1 ch"]),
+    ("2 Chronicles", 36, ["2 chron", "2 chr", "2 ch"]),
+    ("Ezra", 10, ["ezr"]),
+    ("Nehemiah", 13, ["neh", "ne"]),
+    ("Esther", 10, ["esth", "est", "es"]),
+    ("Job", 42, ["jb"]),
+    ("Psalms", 150, ["psalm", "ps", "psa", "pss"]),
+    ("Proverbs", 31, ["prov", "pro", "prv", "pr"]),
+    ("Ecclesiastes", 12, ["eccles", "eccl", "ecc", "qoh"]),
+    ("Song of Solomon", 8, ["song of songs", "song", "sos", "canticles"]),
+    ("Isaiah", 66, ["isa", "is"]),
+    ("Jeremiah", 52, ["jer", "je", "jr"]),
+    ("Lamentations", 5, ["lam", "la"]),
+    ("Ezekiel", 48, ["ezek", "eze", "ezk"]),
+    ("Daniel", 12, ["dan", "da", "dn"]),
+    ("Hosea", 14, ["hos", "ho"]),
+    ("Joel", 3, ["jl"]),
+    ("Amos", 9, ["am"]),
+    ("Obadiah", 1, ["obad", "ob"]),
+    ("Jonah", 4, ["jon", "jnh"]),
+    ("Micah", 7, ["mic", "mc"]),
+    ("Nahum", 3, ["nah", "na"]),
+    ("Habakkuk", 3, ["hab", "hb"]),
+    ("Zephaniah", 3, ["zeph", "zep", "zp"]),
+    ("Haggai", 2, ["hag", "hg"]),
+    ("Zechariah", 14, ["zech", "zec", "zc"]),
+    ("Malachi", 4, ["mal", "ml"]),
+    ("Matthew", 28, ["matt", "mat", "mt"]),
+    ("Mark", 16, ["mrk", "mar", "mk", "mr"]),
+    ("Luke", 24, ["luk", "lk"]),
+    ("John", 21, ["jhn", "jn"]),
+    ("Acts", 28, ["act", "ac"]),
+    ("Romans", 16, ["rom", "ro", "rm"]),
+    ("1 Corinthians", 16, ["1 cor", "1 co"]),
+    ("2 Corinthians", 13, ["2 cor", "2 co"]),
+    ("Galatians", 6, ["gal", "ga"]),
+    ("Ephesians", 6, ["eph", "ephes"]),
+    ("Philippians", 4, ["phil", "php"]),
+    ("Colossians", 4, ["col"]),
+    ("1 Thessalonians", 5, ["1 thess", "1 thes", "1 th"]),
+    ("2 Thessalonians", 3, ["2 thess", "2 thes", "2 th"]),
+    ("1 Timothy", 6, ["1 tim", "1 ti"]),
+    ("2 Timothy", 4, ["2 tim", "2 ti"]),
+    ("Titus", 3, ["tit", "ti"]),
+    ("Philemon", 1, ["philem", "phm", "pm"]),
+    ("Hebrews", 13, ["heb"]),
+    ("James", 5, ["jas", "jm"]),
+    ("1 Peter", 5, ["1 pet", "1 pe", "1 pt"]),
+    ("2 Peter", 3, ["2 pet", "2 pe", "2 pt"]),
+    ("1 John", 5, ["1 jn", "1 jhn", "1 jo"]),
+    ("2 John", 1, ["2 jn", "2 jhn", "2 jo"]),
+    ("3 John", 1, ["3 jn", "3 jhn", "3 jo"]),
+    ("Jude", 1, ["jud", "jd"]),
+    ("Revelation", 22, ["revelations", "rev", "re", "rv", "apocalypse"]),
+]
+
+# Book name plus chapter count, as used for canon-wide jobs
+CANON = [(name, count) for name, count, _ in BOOKS]
+
+NUMBER_WORDS = {"i": "1", "ii": "2", "iii": "3", "first": "1", "second": "2", "third": "3",
+                "1st": "1", "2nd": "2", "3rd": "3"}
+
+def _book_key(text):
+    # "1 Cor." / "I cor" / "1cor" / "First Corinthians" -> "1cor"
+    words = text.lower().replace(".", " ").split()
+    if words and words[0] in NUMBER_WORDS:
+        words[0] = NUMBER_WORDS[words[0]]
+    return "".join(words)
+
+def _build_lookup():
+    lookup = {}
+    for name, count, aliases in BOOKS:
+        for alias in [name] + aliases:
+            lookup.setdefault(_book_key(alias), (name, count))
+    # Any other unambiguous prefix of a full name (3+ letters) also works,
+    # e.g. "deu", "philip", "revel"
+    prefixes = {}
+    for name, count, _ in BOOKS:
+        key = _book_key(name)
+        start = 4 if key[0].isdigit() else 3
+        for end in range(start, len(key)):
+            prefixes.setdefault(key[:end], set()).add((name, count))
+    for prefix, books in prefixes.items():
+        if len(books) == 1 and prefix not in lookup:
+            lookup[prefix] = next(iter(books))
+    return lookup
+
+BOOK_LOOKUP = _build_lookup()
+
+# -----------------------------
+# Reference parsing
+# -----------------------------
+REF_RE = re.compile(
+    r"^\s*(?P<book>(?:[123]|i{1,3}|first|second|third|1st|2nd|3rd)?\s*[a-z][a-z.\s]*?)"
+    r"\s*(?:(?P<start>\d+)(?:\s*[-–—]\s*(?P<end>\d+))?)?\s*$",
+    re.IGNORECASE
+)
+
+def find_book(text):
+    """
+    Return (book_name, chapter_count) for a book name or abbreviation.
+    """
+    book = BOOK_LOOKUP.get(_book_key(text))
+    if book is None:
+        raise ValueError(f"Unknown book: {text.strip()}")
+    return book
+
+def parse_ref(text):
+    """
+    Parse "Romans 8", "rom 8", "ROMANS  8", "Romans 5-8" or "Jude" into a
+    list of canonical chapter refs. Raises ValueError for anything that is
+    not a chapter (or chapter range) of the canon.
+    """
+    if ":" in text:
+        raise ValueError(f"Expected a whole chapter such as 'John 3', not a verse: {text.strip()}")
+    m = REF_RE.match(text)
+    if not m:
+        raise ValueError(f"Not a chapter reference: {text.strip()}")
+    name, count = find_book(m.group("book"))
+    if m.group("start") is None:
+        # Single-chapter books may be named on their own
+        if count != 1:
+            raise ValueError(f"Which chapter of {name}? (1-{count})")
+        return [f"{name} 1"]
+    start = int(m.group("start"))
+    end = int(m.group("end") or start)
+    if not 1 <= start <= end <= count:
+        if start > end:
+            raise ValueError(f"Chapter range runs backwards: {text.strip()}")
+        raise ValueError(f"{name} has {count} chapter{'s' if count > 1 else ''}")
+    return [f"{name} {chapter}" for chapter in range(start, end + 1)]
+
+def canonical_ref(text):
+    """
+    Canonical form of a single chapter reference, e.g. "rom 8" -> "Romans 8".
+    """
+    refs = parse_ref(text)
+    if len(refs) != 1:
+        raise ValueError(f"Enter a single chapter, not a range: {text.strip()}")
+    return refs[0]
+
+def canon_refs():
+    return [f"{name} {chapter}" for name, count in CANON for chapter in range(1, count + 1)]
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import verse_store
+import bible_refs
+import llm_cache
+import aio
+
+# -----------------------------
+# Precomputed classification index
+# -----------------------------
+# Finished classifications keyed by normalized chapter reference. Filled
+# offline by precompute_canon.py and read by the web routes before they
+# call the LLM, so steady-state traffic is a single primary-key lookup.
+# Entries remember the model that produced them; switching MODEL makes
+# the old entries misses rather than serving stale answers.
+DB_PATH = os.getenv(
+    "CLASSIFICATION_INDEX_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "classifications.db")
+)
+
+INDEX_STATS = {"hits": 0, "misses": 0, "writes": 0}
+
+_local = threading.local()
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS classifications ("
+            "ref TEXT NOT NULL, kind TEXT NOT NULL, model TEXT NOT NULL, "
+            "result TEXT NOT NULL, updated REAL NOT NULL, PRIMARY KEY (ref, kind))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lesson_chapters ("
+            "kind TEXT NOT NULL, category TEXT NOT NULL, lesson_name TEXT NOT NULL, "
+            "lesson_text TEXT NOT NULL, ref TEXT NOT NULL, canon_order INTEGER NOT NULL, "
+            "role TEXT NOT NULL, key_verse TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS lesson_chapters_by_lesson "
+            "ON lesson_chapters (kind, lesson_name, canon_order)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS lesson_chapters_by_ref ON lesson_chapters (kind, ref)"
+        )
+        _local.conn = conn
+    return conn
+
+def _reset_after_fork():
+    # SQLite connections must not cross a fork; each server worker opens its own
+    global _local
+    _local = threading.local()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def lookup_raw(chapter_ref, kind, model):
+    """
+    Return (result JSON text, updated Unix time) for a chapter, or None on a miss.
+    """
+    key = verse_store.normalize_ref(chapter_ref)
+    row = _connect().execute(
+        "SELECT result, updated FROM classifications WHERE ref = ? AND kind = ? AND model = ?",
+        (key, kind, model)
+    ).fetchone()
+    if row:
+        INDEX_STATS["hits"] += 1
+        return row
+    INDEX_STATS["misses"] += 1
+    return None
+
+def lookup(chapter_ref, kind, model):
+    """
+    Return the stored result for a chapter, or None on a miss.
+    """
+    row = lookup_raw(chapter_ref, kind, model)
+    return json.loads(row[0]) if row else None
+
+def store(chapter_ref, kind, model, result):
+    key = verse_store.normalize_ref(chapter_ref)
+    conn = _connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO classifications (ref, kind, model, result, updated) VALUES (?, ?, ?, ?, ?)",
+            (key, kind, model, json.dumps(result, separators=(",", ":")), time.time())
+        )
+        _index_lessons(conn, key, kind, result)
+    INDEX_STATS["writes"] += 1
+
+def indexed_refs(kind, model):
+    conn = _connect()
+    return {
+        row[0] for row in conn.execute(
+            "SELECT ref FROM classifications WHERE kind = ? AND model = ?", (kind, model)
+        )
+    }
+
+def cached_classify(chapter_ref, kind, model, classify, refresh=False):
+    """
+    Serve a chapter from the index, calling classify(chapter_ref) and
+    storing its result only on a miss or when refresh is set. A refresh
+    also skips the LLM response cache.
+    """
+    if not refresh:
+        result = lookup(chapter_ref, kind, model)
+        if result is not None:
+            return result
+        result = classify(chapter_ref)
+    else:
+        with llm_cache.refreshing():
+            result = classify(chapter_ref)
+    store(chapter_ref, kind, model, result)
+    return result
+
+async def cached_classify_async(chapter_ref, kind, model, classify, refresh=False):
+    # Index reads and writes run off the event loop
+    if not refresh:
+        result = await aio.blocking(lookup, chapter_ref, kind, model)
+        if result is not None:
+            return result
+        result = await classify(chapter_ref)
+    else:
+        with llm_cache.refreshing():
+            result = await classify(chapter_ref)
+    await aio.blocking(store, chapter_ref, kind, model, result)
+    return result
+
+# -----------------------------
+# Reverse index: lesson -> chapters
+# -----------------------------
+# One row per (chapter, lesson) from the normalized main_lesson /
+# other_lessons, rewritten in the same transaction as the chapter's
+# result, so "which chapters teach X" is an indexed range scan in
+# canonical book order instead of a scan over every stored result.
+_canon_order = None
+
+def canon_order(key):
+    global _canon_order
+    if _canon_order is None:
+        _canon_order = {verse_store.normalize_ref(ref): i for i, ref in enumerate(bible_refs.canon_refs())}
+    # Chapters outside the canon list sort last
+    return _canon_order.get(key, len(_canon_order))
+
+def _lesson_rows(key, kind, result):
+    if not isinstance(result, dict):
+        return []
+    lessons = [("main", result.get("main_lesson"))]
+    lessons += [("other", l) for l in result.get("other_lessons") or []]
+    order = canon_order(key)
+    return [
+        (kind, lesson["category"], lesson["lesson_name"], lesson.get("lesson_text", lesson["lesson_name"]),
+         key, order, role, str(lesson.get("key_verse", "")))
+        for role, lesson in lessons
+        if isinstance(lesson, dict) and lesson.get("category") and lesson.get("lesson_name")
+    ]
+
+def _index_lessons(conn, key, kind, result):
+    conn.execute("DELETE FROM lesson_chapters WHERE kind = ? AND ref = ?", (kind, key))
+    conn.executemany(
+        "INSERT INTO lesson_chapters "
+        "(kind, category, lesson_name, lesson_text, ref, canon_order, role, key_verse) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        _lesson_rows(key, kind, result)
+    )
+
+def chapters_by_lesson(kind, lesson_name, page=1, per_page=20, role=None):
+    """
+    Chapters teaching a lesson, in canonical order.
+    Returns (total, [{"ref", "role", "category", "lesson_text", "key_verse"}, ...]).
+    """
+    where = "kind = ? AND lesson_name = ?"
+    params = [kind, lesson_name]
+    if role:
+        where += " AND role = ?"
+        params.append(role)
+    conn = _connect()
+    total = conn.execute(f"SELECT COUNT(*) FROM lesson_chapters WHERE {where}", params).fetchone()[0]
+    rows = conn.execute(
+        f"SELECT ref, role, category, lesson_text, key_verse FROM lesson_chapters WHERE {where} "
+        "ORDER BY canon_order, role LIMIT ? OFFSET ?",
+        params + [per_page, (page - 1) * per_page]
+    ).fetchall()
+    return total, [
+        {"ref": _display_ref(ref), "role": r, "category": category, "lesson_text": text, "key_verse": key_verse}
+        for ref, r, category, text, key_verse in rows
+    ]
+
+def _display_ref(key):
+    # Rows are keyed by the lower-cased ref ("john 3"); show "John 3"
+    try:
+        return bible_refs.canonical_ref(key)
+    except ValueError:
+        return key
+
+def rebuild_lessons():
+    """
+    Recreate the reverse index from the stored results (e.g. for an index
+    filled before the reverse index existed).
+    """
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM lesson_chapters")
+        for key, kind, result in conn.execute("SELECT ref, kind, result FROM classifications").fetchall():
+            _index_lessons(conn, key, kind, json.loads(result))
+    return conn.execute("SELECT COUNT(*) FROM lesson_chapters").fetchone()[0]
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "rebuild":
+        print(f"{rebuild_lessons()} lesson rows indexed in {DB_PATH}")
+    else:
+        print("usage: python classification_index.py rebuild")
@@ -0,0 +1,107 @@
+import re
+import zlib
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # optional: without numpy every prompt lists the whole taxonomy
+    np = None
+
+# -----------------------------
+# Local lesson / verse pre-ranking
+# -----------------------------
+# Taxonomy entries and chapter text are embedded as hashed TF-IDF vectors
+# (whole words plus 4-character pieces of each word, so "justified" is
+# near "Justification") and compared by cosine similarity with one matrix
+# product. It takes a millisecond or two of CPU per chapter and needs no
+# model download; it only has to keep the plausible lessons, the
+# LLM still makes the choice.
+DIMENSIONS = 1 << 13
+
+RANK_STATS = {"rankings": 0, "lessons_kept": 0, "lessons_dropped": 0, "verses_kept": 0, "verses_dropped": 0}
+_stats_lock = threading.Lock()
+
+WORD_RE = re.compile(r"[a-z]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from he her him his i in is it its of on or our
+shall so that the their them they this thou thy to unto was we were which who will
+with ye you your
+""".split())
+
+def available():
+    return np is not None
+
+def _features(text):
+    for word in WORD_RE.findall(text.lower().replace("’", "'")):
+        if word in STOPWORDS or len(word) < 3:
+            continue
+        yield word
+        padded = f"<{word}>"
+        for i in range(len(padded) - 3):
+            yield padded[i:i + 4]
+
+def _bucket(feature):
+    # crc32 rather than hash(), which differs between processes
+    return zlib.crc32(feature.encode("utf-8")) % DIMENSIONS
+
+def _counts(texts):
+    matrix = np.zeros((len(texts), DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            matrix[row, _bucket(feature)] += 1
+    # Sublinear term frequency, so a repeated word does not dominate
+    np.log1p(matrix, out=matrix)
+    return matrix
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def _record(kind, kept, total):
+    with _stats_lock:
+        RANK_STATS[f"{kind}_kept"] += kept
+        RANK_STATS[f"{kind}_dropped"] += total - kept
+
+class LessonRanker:
+    """
+    Ranks a fixed list of (key, text) taxonomy entries against a chapter.
+    Built once at import; rank() is safe to call from any thread.
+    """
+    def __init__(self, entries):
+        self.keys = [key for key, _ in entries]
+        self._rows = {key: i for i, key in enumerate(self.keys)}
+        counts = _counts([text for _, text in entries])
+        # Features shared by many entries ("god") say little about any one
+        document_frequency = (counts > 0).sum(axis=0)
+        self.idf = np.log((1 + len(entries)) / (1 + document_frequency)).astype(np.float32) + 1.0
+        self.vectors = _normalize(counts * self.idf)
+
+    def embed(self, texts):
+        return _normalize(_counts(texts) * self.idf)
+
+    def rank(self, chapter_text, k):
+        """
+        The k best-matching entries as [(key, score), ...], best first.
+        """
+        scores = self.vectors @ self.embed([chapter_text])[0]
+        k = min(k, len(self.keys))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        with _stats_lock:
+            RANK_STATS["rankings"] += 1
+        _record("lessons", k, len(self.keys))
+        return [(self.keys[i], float(scores[i])) for i in top]
+
+    def rank_verses(self, verse_texts, lesson_keys, k):
+        """
+        Indexes of the k verses closest to the given lessons, in verse order.
+        """
+        if k >= len(verse_texts):
+            return list(range(len(verse_texts)))
+        rows = [self._rows[key] for key in lesson_keys]
+        query = self.vectors[rows].sum(axis=0)
+        scores = self.embed(verse_texts) @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        _record("verses", k, len(verse_texts))
+        return sorted(int(i) for i in top)
@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import itertools
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict
+import timing
+import aio
+import llm_scheduler
+
+# -----------------------------
+# Settings
+# -----------------------------
+# In-memory tier size in entries (0 disables the cache entirely)
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+# Seconds a cached completion stays valid in either tier
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Optional on-disk tier shared between processes, e.g. LLM_CACHE_DB=llm_cache.db
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")
+LLM_CACHE_DISK_MAX = int(os.getenv("LLM_CACHE_DISK_MAX", "20000"))
+# The disk tier is trimmed once every this many writes, so it can run
+# this far over LLM_CACHE_DISK_MAX in between
+LLM_CACHE_EVICT_EVERY = int(os.getenv("LLM_CACHE_EVICT_EVERY", "100"))
+
+CACHE_STATS = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+# Token usage reported by the provider for requests that reached it
+USAGE_STATS = {"completions": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+# -----------------------------
+# In-process LRU tier
+# -----------------------------
+class LRUCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, stored_at = item
+            if time.time() - stored_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, stored_at=None):
+        with self._lock:
+            self._data[key] = (value, stored_at or time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                CACHE_STATS["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+# -----------------------------
+# Optional on-disk tier
+# -----------------------------
+class DiskCache:
+    def __init__(self, path, max_entries, ttl, evict_every=LLM_CACHE_EVICT_EVERY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evict_every = max(1, evict_every)
+        self._puts = itertools.count(1)
+        self._local = threading.local()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_by_age ON responses (stored_at)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value, stored_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return row
+
+    def put(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, value, time.time())
+            )
+        if next(self._puts) % self.evict_every == 0:
+            self.evict()
+
+    def delete(self, key):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self):
+        """
+        Drop expired entries, then the oldest beyond max_entries. Both walk
+        the stored_at index, so only the rows removed are visited.
+        """
+        conn = self._connect()
+        with conn:
+            removed = conn.execute(
+                "DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+            # stored_at of the newest entry that no longer fits
+            row = conn.execute(
+                "SELECT stored_at FROM responses ORDER BY stored_at DESC LIMIT 1 OFFSET ?", (self.max_entries,)
+            ).fetchone()
+            if row is not None:
+                removed += conn.execute("DELETE FROM responses WHERE stored_at <= ?", (row[0],)).rowcount
+        CACHE_STATS["evictions"] += removed
+
+_memory = LRUCache(LLM_CACHE_SIZE, LLM_CACHE_TTL)
+_disk = DiskCache(LLM_CACHE_DB, LLM_CACHE_DISK_MAX, LLM_CACHE_TTL) if LLM_CACHE_DB else None
+
+# -----------------------------
+# Cached chat completion
+# -----------------------------
+def cache_key(model, messages, **params):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _lookup(key):
+    content = _memory.get(key)
+    if content is not None:
+        CACHE_STATS["hits"] += 1
+        return content
+    return _lookup_disk(key)
+
+def _lookup_disk(key):
+    if _disk is not None:
+        row = _disk.get(key)
+        if row is not None:
+            CACHE_STATS["disk_hits"] += 1
+            _memory.put(key, row[0], stored_at=row[1])
+            return row[0]
+    CACHE_STATS["misses"] += 1
+    return None
+
+def _store(key, content):
+    _memory.put(key, content)
+    if _disk is not None:
+        _disk.put(key, content)
+
+def _forget(key):
+    _memory.delete(key)
+    if _disk is not None:
+        _disk.delete(key)
+
+def _accepted(content, parse):
+    """
+    parse(content), or content itself without a parser. An answer the
+    parser rejects (ValueError) is never cached, and a cached answer it
+    rejects is dropped, so a retry asks the model again instead of
+    replaying the same broken output until it expires.
+    """
+    return content if parse is None else parse(content)
+
+async def _lookup_async(key):
+    content = _memory.get(key)
+    if content is not None:
+        CACHE_STATS["hits"] += 1
+        return content
+    # The disk tier is SQLite, so it is read off the event loop
+    return await aio.blocking(_lookup_disk, key) if _disk is not None else _lookup_disk(key)
+
+async def _store_async(key, content):
+    _memory.put(key, content)
+    if _disk is not None:
+        await aio.blocking(_disk.put, key, content)
+
+def record_usage(response):
+    USAGE_STATS["completions"] += 1
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        USAGE_STATS["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        USAGE_STATS["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+def _cacheable(temperature):
+    return LLM_CACHE_SIZE > 0 and temperature == 0
+
+# Set while a caller forces a fresh answer: cached answers are skipped,
+# and the new answer replaces them
+_refresh = contextvars.ContextVar("llm_cache_refresh", default=False)
+
+@contextlib.contextmanager
+def refreshing():
+    token = _refresh.set(True)
+    try:
+        yield
+    finally:
+        _refresh.reset(token)
+
+def cached_completion(client, model, messages, temperature=0, parse=None, **params):
+    """
+    Return the completion text for a chat request, reusing an earlier answer
+    for the same (model, messages, params). Only deterministic requests
+    (temperature 0) are cached. With parse, return parse(text) instead and
+    cache only answers it accepts (see _accepted).
+    """
+    key = cache_key(model, messages, temperature=temperature, **params)
+    if _cacheable(temperature) and not _refresh.get():
+        content = _lookup(key)
+        if content is not None:
+            try:
+                return _accepted(content, parse)
+            except ValueError:
+                _forget(key)
+
+    response = llm_scheduler.create(
+        client.chat.completions.create, model=model, messages=messages, temperature=temperature, **params
+    )
+    record_usage(response)
+    content = response.choices[0].message.content
+    result = _accepted(content, parse)
+    if _cacheable(temperature):
+        _store(key, content)
+    return result
+
+async def cached_completion_async(client, model, messages, temperature=0, parse=None, **params):
+    """
+    Same as cached_completion for an async (AsyncGroq / AsyncOpenAI) client.
+    """
+    key = cache_key(model, messages, temperature=temperature, **params)
+    if _cacheable(temperature) and not _refresh.get():
+        content = await _lookup_async(key)
+        if content is not None:
+            try:
+                return _accepted(content, parse)
+            except ValueError:
+                await aio.blocking(_forget, key)
+
+    response = await llm_scheduler.create_async(
+        client.chat.completions.create, model=model, messages=messages, temperature=temperature, **params
+    )
+    record_usage(response)
+    content = response.choices[0].message.content
+    result = _accepted(content, parse)
+    if _cacheable(temperature):
+        await _store_async(key, content)
+    return result
+
+def stream_completion(client, model, messages, temperature=0, parse=None, **params):
+    """
+    Yield the completion text in pieces as the model produces it. A cached
+    answer is yielded in one piece; a streamed answer is cached once
+    complete, if parse (when given) accepts the whole text.
+    """
+    key = cache_key(model, messages, temperature=temperature, **params)
+    if _cacheable(temperature) and not _refresh.get():
+        content = _lookup(key)
+        if content is not None:
+            try:
+                _accepted(content, parse)
+            except ValueError:
+                _forget(key)
+            else:
+                yield content
+                return
+
+    # Time only the model's side: opening the stream (not the wait for
+    # admission) and the waits for each chunk
+    opened = []
+    def open_stream(**request):
+        start = time.perf_counter()
+        try:
+            return client.chat.completions.create(**request)
+        finally:
+            opened.append(time.perf_counter() - start)
+
+    stream = llm_scheduler.create(
+        open_stream, model=model, messages=messages, temperature=temperature, stream=True, **params
+    )
+    pieces = []
+    waited = sum(opened)
+    start = time.perf_counter()
+    for chunk in stream:
+        waited += time.perf_counter() - start
+        if chunk.choices and chunk.choices[0].delta.content:
+            piece = chunk.choices[0].delta.content
+            pieces.append(piece)
+            yield piece
+        start = time.perf_counter()
+    timing.record("llm", waited + time.perf_counter() - start)
+    # Streamed responses carry no usage block
+    USAGE_STATS["completions"] += 1
+    content = "".join(pieces)
+    if _cacheable(temperature):
+        try:
+            _accepted(content, parse)
+        except ValueError:
+            return
+        _store(key, content)
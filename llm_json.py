@@ -0,0 +1,327 @@
+import re
+import sys
+import json
+import time
+
+# -----------------------------
+# Tolerant JSON parser for LLM output
+# -----------------------------
+# One left-to-right pass over the text. Compared with strict JSON it
+# accepts: prose or ``` fences before and after the object, smart quotes
+# used as string delimiters, unescaped quotes inside strings (a quote only
+# ends a string when what follows looks like JSON structure), raw newlines
+# in strings, trailing commas, unquoted keys and Python-style literals.
+
+QUOTES = '"“”'
+NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?")
+IDENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+LITERALS = {
+    "true": True, "false": False, "null": None,
+    "True": True, "False": False, "None": None
+}
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+STRING_STOP_RE = re.compile(r'["“”\\]')
+KEY_STOP_RE = re.compile(r'["“”\n{}\[\],:]')
+WS_RE = re.compile(r"[ \t\r\n]*")
+VALUE_START = QUOTES + "{[-0123456789tfnTFN"
+
+class _Parser:
+    def __init__(self, text, final=True):
+        self.text = text
+        self.pos = 0
+        self.n = len(text)
+        # final: the text is the whole response, so running out of input
+        # settles an open question instead of meaning "wait for more"
+        self.final = final
+
+    def skip_ws(self, pos=None):
+        return WS_RE.match(self.text, self.pos if pos is None else pos).end()
+
+    def peek(self):
+        self.pos = self.skip_ws()
+        return self.text[self.pos] if self.pos < self.n else ""
+
+    # Every parse_* method returns (value, complete). complete is False only
+    # when the text ran out first; a partial value is still returned so a
+    # caller reading a token stream can use what has arrived so far.
+    def parse_value(self, ctx):
+        c = self.peek()
+        if c == "":
+            return None, False
+        if c == "{":
+            return self.parse_object()
+        if c == "[":
+            return self.parse_array()
+        if c in QUOTES:
+            return self.parse_string(ctx)
+        if c == "-" or c.isdigit():
+            m = NUMBER_RE.match(self.text, self.pos)
+            if m is None:
+                # A '-' with no digit after it: a markdown bullet, "- 1", or a
+                # stream that has not sent the digits yet
+                if self.pos + 1 >= self.n:
+                    return None, False
+                raise ValueError(f"Unexpected character {c!r} at position {self.pos}")
+            self.pos = m.end()
+            if self.pos >= self.n:
+                return None, False
+            number = m.group(0)
+            return (float(number) if any(ch in number for ch in ".eE") else int(number)), True
+        m = IDENT_RE.match(self.text, self.pos)
+        if m and m.group(0) in LITERALS:
+            self.pos = m.end()
+            return LITERALS[m.group(0)], True
+        if m and m.end() >= self.n:
+            return None, False
+        raise ValueError(f"Unexpected character {c!r} at position {self.pos}")
+
+    def parse_object(self):
+        self.pos += 1
+        obj = {}
+        while True:
+            c = self.peek()
+            if c == "":
+                return obj, False
+            if c == "}":
+                self.pos += 1
+                return obj, True
+            if c == ",":
+                self.pos += 1
+                continue
+            if c in QUOTES:
+                key, complete = self.parse_string("key")
+            else:
+                m = IDENT_RE.match(self.text, self.pos)
+                if not m:
+                    raise ValueError(f"Expected a key at position {self.pos}")
+                self.pos = m.end()
+                key, complete = m.group(0), self.pos < self.n
+            if not complete:
+                return obj, False
+            if self.peek() != ":":
+                if self.pos >= self.n:
+                    return obj, False
+                raise ValueError(f"Expected ':' at position {self.pos}")
+            self.pos += 1
+            value, complete = self.parse_value("object")
+            if not complete:
+                # Keep a list that is still filling up; drop anything else half-read
+                if isinstance(value, list):
+                    obj[key] = value
+                return obj, False
+            obj[key] = value
+
+    def parse_array(self):
+        self.pos += 1
+        arr = []
+        while True:
+            c = self.peek()
+            if c == "":
+                return arr, False
+            if c == "]":
+                self.pos += 1
+                return arr, True
+            if c == ",":
+                self.pos += 1
+                continue
+            value, complete = self.parse_value("array")
+            if not complete:
+                return arr, False
+            arr.append(value)
+
+    def parse_string(self, ctx):
+        self.pos += 1
+        chunks = []
+        start = self.pos
+        text = self.text
+        while True:
+            # Jump straight to the next character that needs attention
+            m = STRING_STOP_RE.search(text, self.pos)
+            if not m:
+                return None, False
+            end = m.start()
+            chunks.append(text[start:end])
+            c = text[end]
+            if c == "\\":
+                if end + 1 >= self.n:
+                    return None, False
+                e = text[end + 1]
+                if e == "u":
+                    if end + 6 > self.n:
+                        return None, False
+                    try:
+                        chunks.append(chr(int(text[end + 2:end + 6], 16)))
+                        self.pos = end + 6
+                    except ValueError:
+                        chunks.append(text[end:end + 2])
+                        self.pos = end + 2
+                else:
+                    chunks.append(ESCAPES.get(e, "\\" + e))
+                    self.pos = end + 2
+                start = self.pos
+                continue
+            closes = self.closes_string(end, ctx)
+            if closes is None:
+                return None, False
+            if closes:
+                self.pos = end + 1
+                return "".join(chunks), True
+            # Inner quote: keep it as part of the text
+            chunks.append(c)
+            self.pos = start = end + 1
+
+    def closes_string(self, pos, ctx):
+        """
+        Decide whether the quote at pos ends the current string by looking at
+        what follows it. Returns None if the text runs out before we can tell.
+        """
+        j = self.skip_ws(pos + 1)
+        if j >= self.n:
+            return None
+        c = self.text[j]
+        if ctx == "key":
+            return c == ":"
+        if c in "}]":
+            return True
+        if c in QUOTES and ctx == "object":
+            # Missing comma before the next key: "a": "x" "b": ...
+            return self._quoted_key_at(j)
+        if c != ",":
+            return False
+        k = self.skip_ws(j + 1)
+        if k >= self.n:
+            return None
+        d = self.text[k]
+        if ctx == "object":
+            return d in QUOTES or d == "}" or bool(IDENT_RE.match(self.text, k) and self._is_key(k))
+        return d in VALUE_START or d == "]"
+
+    def _quoted_key_at(self, j):
+        # Keys never contain structure, so stop at the first such character
+        k = KEY_STOP_RE.search(self.text, j + 1)
+        if not k:
+            return False if self.final else None
+        k = k.start()
+        if self.text[k] not in QUOTES:
+            return False
+        m = self.skip_ws(k + 1)
+        return m < self.n and self.text[m] == ":"
+
+    def _is_key(self, k):
+        # Unquoted key: identifier followed by ':'
+        m = IDENT_RE.match(self.text, k)
+        j = self.skip_ws(m.end())
+        return j < self.n and self.text[j] == ":"
+
+def _starts(text):
+    # Prefer objects; fall back to a bare array
+    starts = [m.start() for m in re.finditer(r"\{", text)]
+    if not starts and "[" in text:
+        starts = [text.index("[")]
+    return starts
+
+def parse_partial(text):
+    """
+    Parse as much of a (possibly unfinished) LLM response as possible.
+    Returns (value, complete); value is None until an object has started.
+    Containers that are still open hold only their finished members.
+    """
+    starts = _starts(text)
+    if not starts:
+        return None, False
+    parser = _Parser(text, final=False)
+    parser.pos = starts[0]
+    try:
+        return parser.parse_value("top")
+    except ValueError:
+        return None, False
+
+def loads(text):
+    """
+    Parse the first JSON object in an LLM response. If prose before it
+    contains a stray '{', parsing restarts at the next one.
+    """
+    starts = _starts(text)
+    if not starts:
+        raise ValueError("No JSON object found in LLM output.")
+    first_error = None
+    for start in starts:
+        parser = _Parser(text)
+        parser.pos = start
+        try:
+            value, complete = parser.parse_value("top")
+        except ValueError as e:
+            first_error = first_error or e
+            continue
+        if complete:
+            return value
+        first_error = first_error or ValueError(
+            f"LLM output ended before the JSON object was complete:\n{text}"
+        )
+    raise ValueError(f"Invalid JSON in LLM output: {first_error}\n{text}")
+
+# -----------------------------
+# Incremental use on a token stream
+# -----------------------------
+class StreamParser:
+    """
+    Feed LLM tokens as they arrive; value holds everything parsed so far.
+    The buffer is only re-parsed when a chunk closes an object or array,
+    which is the only point at which new complete members can appear.
+    """
+    def __init__(self):
+        self.text = ""
+        self.value = None
+        self.complete = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        if "}" in chunk or "]" in chunk:
+            self.value, self.complete = parse_partial(self.text)
+        return self.value
+
+    def close(self):
+        self.value = loads(self.text)
+        self.complete = True
+        return self.value
+
+# -----------------------------
+# Corpus check and benchmark
+# -----------------------------
+CORPUS_PATH = "llm_json_corpus.json"
+
+def run_corpus(path=CORPUS_PATH, rounds=200):
+    with open(path, encoding="utf-8") as f:
+        corpus = json.load(f)
+    failures = 0
+    for case in corpus:
+        try:
+            got = loads(case["raw"])
+        except ValueError as e:
+            got = f"ERROR: {e}"
+        # Streaming must reach the same answer token by token
+        stream = StreamParser()
+        for i in range(0, len(case["raw"]), 4):
+            stream.feed(case["raw"][i:i + 4])
+        try:
+            streamed = stream.close()
+        except ValueError as e:
+            streamed = f"ERROR: {e}"
+        ok = got == streamed == case["expected"]
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {case['name']}")
+        if not ok:
+            print(f"     expected: {case['expected']!r}\n     got:      {got!r}")
+
+    parseable = [case["raw"] for case in corpus if not isinstance(case["expected"], str)]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for raw in parseable:
+            loads(raw)
+    elapsed = time.perf_counter() - start
+    per_parse = elapsed / (rounds * len(parseable)) * 1e6
+    print(f"\n{len(corpus) - failures}/{len(corpus)} cases passed; {per_parse:.1f} µs per parse")
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if run_corpus(*sys.argv[1:2]) else 0)
@@ -0,0 +1,303 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import contextlib
+import contextvars
+import timing
+from prompt_builder import estimate_tokens
+
+# -----------------------------
+# Settings
+# -----------------------------
+# Every chat completion goes through admit() before it is sent, so a burst
+# queues here instead of turning into 429s from Groq. LLM_RPM / LLM_TPM
+# are the account's limits; buckets live in each process, so serve.py
+# gives every worker its share (share_budget). 0 turns a limit off.
+LLM_RPM = int(os.getenv("LLM_RPM", "30"))
+LLM_TPM = int(os.getenv("LLM_TPM", "6000"))
+# Tokens assumed for the answer when a request sets no max_tokens
+COMPLETION_ALLOWANCE = int(os.getenv("LLM_COMPLETION_ALLOWANCE", "300"))
+# How long a request may wait for admission before it is turned away
+LANE_MAX_WAIT = {
+    "interactive": float(os.getenv("LLM_MAX_WAIT", "20")),
+    "batch": float(os.getenv("LLM_BATCH_MAX_WAIT", "600"))
+}
+# Retries after a 429 that got through anyway (e.g. another process used the budget)
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "1.0"))
+# How often an async request waiting for admission checks its turn
+ADMIT_POLL = float(os.getenv("LLM_ADMIT_POLL", "0.05"))
+
+# Lower number is admitted first
+LANES = {"interactive": 0, "batch": 1}
+
+SCHEDULER_STATS = {"admitted": 0, "rate_limited": 0, "retries": 0, "busy": 0}
+QUEUE_DEPTH = {lane: 0 for lane in LANES}
+
+BUSY_MESSAGE = "The classifier is busy right now. Please try again in a minute."
+
+class LLMBusyError(RuntimeError):
+    """
+    Raised instead of sending a request that could not be admitted in time.
+    """
+    def __init__(self, message=BUSY_MESSAGE):
+        super().__init__(message)
+
+# -----------------------------
+# Priority lanes
+# -----------------------------
+# Web requests run in the interactive lane. Background work (precompute,
+# queued ticket batches, audits) wraps itself in lane("batch") and only
+# gets a slot when no interactive request is waiting.
+_lane = contextvars.ContextVar("llm_lane", default="interactive")
+
+@contextlib.contextmanager
+def lane(name):
+    if name not in LANES:
+        raise ValueError(f"Unknown lane: {name}")
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+def current_lane():
+    return _lane.get()
+
+# -----------------------------
+# Token buckets
+# -----------------------------
+class TokenBucket:
+    """
+    Holds up to per_minute units and refills continuously; per_minute=0 never limits.
+    Not locked: the scheduler holds its own lock around every call.
+    """
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_for(self, amount, now):
+        """
+        Seconds until amount units are available (0 if they are now).
+        """
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        # A single request larger than the whole budget waits for a full bucket
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) * 60.0 / self.capacity)
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + amount)
+
+    def drain(self, now):
+        if self.capacity:
+            self._refill(now)
+            self.level = min(self.level, 0.0)
+
+class Scheduler:
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM):
+        self._cond = threading.Condition()
+        self.set_limits(rpm, tpm)
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def admit(self, tokens, lane_name=None):
+        """
+        Block until one request of `tokens` estimated tokens fits both
+        budgets and no higher-priority or earlier request is waiting.
+        Raises LLMBusyError if that would take longer than the lane allows.
+        """
+        lane_name = lane_name or current_lane()
+        deadline = time.monotonic() + LANE_MAX_WAIT[lane_name]
+        with self._cond:
+            entry = self._join(lane_name)
+            try:
+                while True:
+                    wait = self._try_admit(entry, tokens, deadline)
+                    if wait is None:
+                        return
+                    self._cond.wait(wait)
+            finally:
+                self._leave(entry, lane_name)
+
+    async def admit_async(self, tokens, lane_name=None):
+        """
+        Same as admit, waiting on the event loop instead of a thread. The
+        condition cannot wake a coroutine, so the wait is re-checked at
+        least every ADMIT_POLL seconds.
+        """
+        lane_name = lane_name or current_lane()
+        deadline = time.monotonic() + LANE_MAX_WAIT[lane_name]
+        with self._cond:
+            entry = self._join(lane_name)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_admit(entry, tokens, deadline)
+                if wait is None:
+                    return
+                await asyncio.sleep(min(wait, ADMIT_POLL))
+        finally:
+            with self._cond:
+                self._leave(entry, lane_name)
+
+    # The helpers below run with self._cond held
+    def _join(self, lane_name):
+        entry = (LANES[lane_name], next(self._seq))
+        heapq.heappush(self._waiting, entry)
+        QUEUE_DEPTH[lane_name] += 1
+        return entry
+
+    def _leave(self, entry, lane_name):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        QUEUE_DEPTH[lane_name] -= 1
+        self._cond.notify_all()
+
+    def _try_admit(self, entry, tokens, deadline):
+        """
+        Take the budget if entry may go now and return None; otherwise
+        return how long to wait before trying again.
+        """
+        now = time.monotonic()
+        remaining = deadline - now
+        if self._waiting[0] == entry:
+            wait = max(self.requests.wait_for(1, now), self.tokens.wait_for(tokens, now))
+            if wait == 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                SCHEDULER_STATS["admitted"] += 1
+                return None
+        else:
+            wait = remaining
+        if wait > remaining or remaining <= 0:
+            SCHEDULER_STATS["busy"] += 1
+            raise LLMBusyError()
+        return min(wait, remaining)
+
+    def set_limits(self, rpm, tpm):
+        with self._cond:
+            self.requests = TokenBucket(rpm)
+            self.tokens = TokenBucket(tpm)
+            self._cond.notify_all()
+
+    def settle(self, estimated, actual):
+        """
+        Correct the token budget once the provider reports real usage.
+        """
+        with self._cond:
+            if actual > estimated:
+                self.tokens.take(actual - estimated)
+            else:
+                self.tokens.give_back(estimated - actual)
+            self._cond.notify_all()
+
+    def rate_limited(self):
+        """
+        Groq said 429: empty both buckets so every waiter backs off together.
+        """
+        with self._cond:
+            now = time.monotonic()
+            self.requests.drain(now)
+            self.tokens.drain(now)
+        SCHEDULER_STATS["rate_limited"] += 1
+
+scheduler = Scheduler()
+
+def share_budget(processes):
+    """
+    Limit this process to 1/processes of LLM_RPM and LLM_TPM. Called by
+    serve.py before it forks that many workers, which inherit the share.
+    """
+    processes = max(1, processes)
+    scheduler.set_limits(LLM_RPM / processes, LLM_TPM / processes)
+    return scheduler.requests.capacity, scheduler.tokens.capacity
+
+# -----------------------------
+# Scheduled chat completions
+# -----------------------------
+def estimate_request(messages, **params):
+    prompt = sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+    return prompt + (params.get("max_tokens") or COMPLETION_ALLOWANCE)
+
+def _status(error):
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+def _retry_delay(error, attempt):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    retry_after = str(headers.get("retry-after", ""))
+    try:
+        delay = float(retry_after)
+    except ValueError:
+        delay = LLM_BACKOFF * (2 ** attempt)
+    return delay + random.uniform(0, LLM_BACKOFF)
+
+def _settle(estimated, response):
+    usage = getattr(response, "usage", None)
+    total = getattr(usage, "total_tokens", None) if usage is not None else None
+    if total:
+        scheduler.settle(estimated, total)
+
+def create(create_fn, messages, **params):
+    """
+    client.chat.completions.create(messages=..., **params) once admitted,
+    retrying 429s with jittered backoff. Non-streamed calls are timed as
+    the "llm" stage; a streaming caller times the chunks itself.
+    """
+    estimated = estimate_request(messages, **params)
+    for attempt in range(LLM_RETRIES + 1):
+        with timing.span("admit"):
+            scheduler.admit(estimated)
+        try:
+            with contextlib.nullcontext() if params.get("stream") else timing.span("llm"):
+                response = create_fn(messages=messages, **params)
+        except Exception as e:
+            if _status(e) != 429:
+                raise
+            scheduler.rate_limited()
+            if attempt == LLM_RETRIES:
+                raise LLMBusyError() from e
+            SCHEDULER_STATS["retries"] += 1
+            time.sleep(_retry_delay(e, attempt))
+            continue
+        _settle(estimated, response)
+        return response
+
+async def create_async(create_fn, messages, **params):
+    """
+    Same as create for an async client; admission waits on the event
+    loop, so a long batch queue does not hold executor threads.
+    """
+    estimated = estimate_request(messages, **params)
+    for attempt in range(LLM_RETRIES + 1):
+        with timing.span("admit"):
+            await scheduler.admit_async(estimated)
+        try:
+            with timing.span("llm"):
+                response = await create_fn(messages=messages, **params)
+        except Exception as e:
+            if _status(e) != 429:
+                raise
+            scheduler.rate_limited()
+            if attempt == LLM_RETRIES:
+                raise LLMBusyError() from e
+            SCHEDULER_STATS["retries"] += 1
+            await asyncio.sleep(_retry_delay(e, attempt))
+            continue
+        _settle(estimated, response)
+        return response
@@ -0,0 +1,104 @@
+import time
+import threading
+from flask import Response, g, request
+import timing
+import llm_cache
+import verse_store
+import classification_index
+import single_flight
+import llm_scheduler
+import page_cache
+import lesson_ranker
+from prompt_builder import PROMPT_STATS
+
+# -----------------------------
+# Prometheus metrics
+# -----------------------------
+# install(app) adds request timing and a GET /metrics endpoint in the
+# Prometheus text format. Everything exposed is a counter the modules
+# already keep, plus the timing.py stage histograms, so scraping costs a
+# few dict copies and nothing is added to the request path beyond one
+# perf_counter() pair.
+PREFIX = "bible_classifier"
+
+REQUEST_COUNTS = {}
+_lock = threading.Lock()
+
+# (metric name, help, stats dict, label name); each dict key becomes a label value
+COUNTERS = [
+    ("llm_cache_events_total", "LLM response cache lookups by outcome", llm_cache.CACHE_STATS, "event"),
+    ("llm_usage_total", "LLM completions and tokens reported by the provider", llm_cache.USAGE_STATS, "kind"),
+    ("verse_store_lookups_total", "Verse store lookups by outcome", verse_store.STORE_STATS, "event"),
+    ("classification_index_events_total", "Classification index lookups and writes", classification_index.INDEX_STATS, "event"),
+    ("single_flight_total", "Coalesced requests by role", single_flight.FLIGHT_STATS, "event"),
+    ("llm_scheduler_total", "LLM requests admitted, rate-limited, retried or turned away busy",
+     llm_scheduler.SCHEDULER_STATS, "event"),
+    ("llm_scheduler_queue_depth", "LLM requests waiting for admission by priority lane",
+     llm_scheduler.QUEUE_DEPTH, "lane"),
+    ("page_cache_total", "Indexed chapter pages served from cache, rendered, or answered 304",
+     page_cache.PAGE_STATS, "event"),
+    ("lesson_ranker_total", "Taxonomy entries and verses kept or dropped by local pre-ranking",
+     lesson_ranker.RANK_STATS, "event"),
+    ("prompt_stats", "Prompts built and their estimated tokens", PROMPT_STATS, "kind"),
+]
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render(extra=()):
+    """
+    The full exposition text. extra is a list of further
+    (name, help, dict, label) counters, e.g. an app's own FETCH_STATS.
+    """
+    lines = []
+    for name, help_text, stats, label in list(COUNTERS) + list(extra):
+        metric = f"{PREFIX}_{name}"
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for key, value in list(stats.items()):
+            lines.append(f'{metric}{{{label}="{_label(key)}"}} {value}')
+
+    metric = f"{PREFIX}_stage_seconds"
+    lines.append(f"# HELP {metric} Time spent in each pipeline stage")
+    lines.append(f"# TYPE {metric} histogram")
+    for stage, (cumulative, total, count) in sorted(timing.histograms().items()):
+        for bound, n in zip(timing.BUCKETS, cumulative):
+            lines.append(f'{metric}_bucket{{stage="{_label(stage)}",le="{bound}"}} {n}')
+        lines.append(f'{metric}_bucket{{stage="{_label(stage)}",le="+Inf"}} {count}')
+        lines.append(f'{metric}_sum{{stage="{_label(stage)}"}} {total}')
+        lines.append(f'{metric}_count{{stage="{_label(stage)}"}} {count}')
+
+    metric = f"{PREFIX}_http_requests_total"
+    lines.append(f"# HELP {metric} HTTP requests by endpoint and status")
+    lines.append(f"# TYPE {metric} counter")
+    with _lock:
+        counts = dict(REQUEST_COUNTS)
+    for (endpoint, status), n in sorted(counts.items()):
+        lines.append(f'{metric}{{endpoint="{_label(endpoint)}",status="{status}"}} {n}')
+    return "\n".join(lines) + "\n"
+
+def install(app, extra=()):
+    """
+    Time every request (as the "request" stage) and serve GET /metrics.
+    """
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _count_request(response):
+        start = g.pop("metrics_start", None)
+        endpoint = request.endpoint or "unmatched"
+        if start is not None and endpoint != "metrics":
+            timing.record("request", time.perf_counter() - start)
+        with _lock:
+            key = (endpoint, response.status_code)
+            REQUEST_COUNTS[key] = REQUEST_COUNTS.get(key, 0) + 1
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render(extra), mimetype="text/plain; version=0.0.4")
+
+    return app
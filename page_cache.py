@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import Response, request
+from jinja2 import DictLoader
+import verse_store
+import classification_index
+import llm_scheduler
+import bible_fetch
+
+# -----------------------------
+# Compiled templates
+# -----------------------------
+def use_templates(app, templates):
+    """
+    Serve {name: source} through render_template and compile every
+    template now, so requests only look up the already-compiled template
+    in Jinja's cache instead of parsing source each time.
+    """
+    app.jinja_loader = DictLoader(templates)
+    for name in templates:
+        app.jinja_env.get_template(name)
+    return app
+
+# -----------------------------
+# Rendered pages for indexed chapters
+# -----------------------------
+# GET /?chapter=Romans+8 on a chapter already in the classification index
+# is answered from here: pages carry an ETag and Last-Modified derived from
+# the index entry, so a revalidating client gets a 304 without a render,
+# and other clients get the stored bytes. Entries change key when the
+# chapter is reclassified, so nothing needs invalidating.
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "256"))
+
+PAGE_STATS = {"hits": 0, "misses": 0, "not_modified": 0}
+
+_pages = OrderedDict()
+_lock = threading.Lock()
+
+def _get(etag):
+    with _lock:
+        body = _pages.get(etag)
+        if body is not None:
+            _pages.move_to_end(etag)
+        return body
+
+def _put(etag, body):
+    if PAGE_CACHE_SIZE <= 0:
+        return
+    with _lock:
+        _pages[etag] = body
+        while len(_pages) > PAGE_CACHE_SIZE:
+            _pages.popitem(last=False)
+
+def wants_json():
+    """
+    The JSON variant: ?format=json, or an Accept header that prefers JSON.
+    """
+    if request.args.get("format") == "json":
+        return True
+    return request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json"
+
+def indexed_response(chapter_ref, kind, model, render):
+    """
+    Response for a chapter already in the index (HTML from render(result),
+    or the stored JSON), or None if it has not been classified yet.
+    """
+    row = classification_index.lookup_raw(chapter_ref, kind, model)
+    if row is None:
+        return None
+    result_json, updated = row
+    as_json = wants_json()
+    key = f"{kind}|{model}|{verse_store.normalize_ref(chapter_ref)}|{updated!r}|{'json' if as_json else 'html'}"
+    etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    last_modified = datetime.fromtimestamp(int(updated), tz=timezone.utc)
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = request.if_modified_since is not None and request.if_modified_since >= last_modified
+    if fresh:
+        PAGE_STATS["not_modified"] += 1
+        response = Response(status=304)
+    else:
+        body = _get(etag)
+        if body is not None:
+            PAGE_STATS["hits"] += 1
+        else:
+            PAGE_STATS["misses"] += 1
+            body = result_json if as_json else render(json.loads(result_json))
+            _put(etag, body)
+        response = Response(body, mimetype="application/json" if as_json else "text/html")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Clients may reuse the page but must check it is still current
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept")
+    return response
+
+def error_status(error):
+    """
+    HTTP status for a failed classification in the JSON variant.
+    """
+    if isinstance(error, ValueError):
+        return 404
+    if isinstance(error, (llm_scheduler.LLMBusyError, bible_fetch.UpstreamError)):
+        return 503
+    return 502
@@ -0,0 +1,73 @@
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import verse_store
+import bible_refs
+import classification_index
+import llm_scheduler
+
+# -----------------------------
+# Offline canon precomputation
+# -----------------------------
+# Classifies every chapter of the canon into the classification index so
+# the web apps answer normal traffic without calling the LLM. Each result
+# is written as soon as it arrives, so an interrupted run resumes where it
+# stopped; --refresh reclassifies chapters that are already indexed.
+#
+#   python precompute_canon.py [--app doctrine|themes] [--workers 4] [--limit N] [--refresh]
+
+def load_app(name):
+    if name == "doctrine":
+        import bible_chap_doctrine_wa as module
+    else:
+        import bible_chap_cat_webapp as module
+    return module
+
+def classify_one(module, ref, refresh=False):
+    # Batch lane: a live site sharing the budget keeps priority
+    with llm_scheduler.lane("batch"):
+        return classification_index.cached_classify(
+            ref, module.INDEX_KIND, module.MODEL, module.classify_chapter_internal, refresh=refresh
+        )
+
+def precompute(module, workers=4, limit=None, refresh=False):
+    done = set() if refresh else classification_index.indexed_refs(module.INDEX_KIND, module.MODEL)
+    todo = [ref for ref in bible_refs.canon_refs() if verse_store.normalize_ref(ref) not in done]
+    if limit:
+        todo = todo[:limit]
+    print(f"{len(done)} chapters indexed, {len(todo)} to classify with {workers} workers")
+
+    failures = 0
+    start = time.perf_counter()
+    # The pool size is the bound on concurrent LLM calls
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(classify_one, module, ref, refresh): ref for ref in todo}
+        try:
+            for i, future in enumerate(as_completed(futures), start=1):
+                ref = futures[future]
+                try:
+                    future.result()
+                    status = "ok"
+                except Exception as e:
+                    failures += 1
+                    status = f"FAILED: {e}"
+                print(f"[{i}/{len(todo)}] {ref}: {status}")
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            print("Interrupted; finished chapters are saved, rerun to resume")
+            raise
+    elapsed = time.perf_counter() - start
+    print(f"{len(todo) - failures} classified, {failures} failed in {elapsed:.1f}s")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify the whole canon into the classification index.")
+    parser.add_argument("--app", choices=["doctrine", "themes"], default="doctrine")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--refresh", action="store_true")
+    args = parser.parse_args()
+    failures = precompute(load_app(args.app), workers=args.workers, limit=args.limit, refresh=args.refresh)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,55 @@
+import threading
+
+# -----------------------------
+# Prompt token accounting
+# -----------------------------
+PROMPT_STATS = {"prompts": 0, "estimated_tokens": 0, "max_estimated_tokens": 0}
+_stats_lock = threading.Lock()
+
+def estimate_tokens(text):
+    """
+    Rough token count (~4 characters per token for English with Llama
+    tokenizers). Good enough for budgeting; exact counts come back in
+    response.usage.
+    """
+    return (len(text) + 3) // 4
+
+# -----------------------------
+# Prefix-first prompt builder
+# -----------------------------
+class PromptBuilder:
+    """
+    Holds the static part of a prompt, built once. Every request appends
+    only its own text after it, so the prefix is byte-identical across
+    requests and eligible for provider-side prefix caching.
+    """
+    def __init__(self, system, prefix):
+        self.system = system
+        self.prefix = prefix
+        self.prefix_tokens = estimate_tokens(system) + estimate_tokens(prefix)
+
+    def build(self, suffix):
+        tokens = self.prefix_tokens + estimate_tokens(suffix)
+        with _stats_lock:
+            PROMPT_STATS["prompts"] += 1
+            PROMPT_STATS["estimated_tokens"] += tokens
+            PROMPT_STATS["max_estimated_tokens"] = max(PROMPT_STATS["max_estimated_tokens"], tokens)
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.prefix + suffix}
+        ]
+
+# -----------------------------
+# Short lesson IDs
+# -----------------------------
+def lesson_ids(tiers):
+    """
+    tiers is a list of (id_prefix, category, [(lesson_name, lesson_text), ...]).
+    Returns {"D12": (category, lesson_name, lesson_text), ...} with 1-based
+    indices matching each list's original position.
+    """
+    ids = {}
+    for id_prefix, category, lessons in tiers:
+        for i, (lesson_name, lesson_text) in enumerate(lessons, start=1):
+            ids[f"{id_prefix}{i}"] = (category, lesson_name, lesson_text)
+    return ids
@@ -0,0 +1,108 @@
+import os
+import gc
+import sys
+import argparse
+import importlib
+import importlib.util
+import multiprocessing
+
+# -----------------------------
+# Production server
+# -----------------------------
+# Serves one of the apps under gunicorn (several worker processes, each
+# with a pool of threads), or under waitress where gunicorn cannot run
+# (Windows). The app module is imported before the workers fork, so the
+# taxonomy, compiled lesson matchers and templates, stored verses and
+# Groq client are built once and shared copy-on-write. Connections, the
+# async loop and pooled sockets are re-created in each worker (see the
+# register_at_fork hooks in the modules that own them).
+#
+#   python serve.py doctrine|themes|category|tickets [--host 0.0.0.0] [--port 8000]
+#
+# On SIGTERM gunicorn stops accepting connections and gives requests in
+# progress up to SERVER_GRACEFUL_TIMEOUT seconds to finish. Tickets queued
+# by /tickets but not yet classified stay "queued" in the ticket store
+# until a running worker takes them over (see TICKET_RECLAIM_AFTER).
+# Counters at /metrics are per worker process. LLM_RPM / LLM_TPM are the
+# account's limits: each worker gets an equal share of them, so the
+# workers together stay within the account.
+APPS = {
+    "doctrine": "bible_chap_doctrine_wa",
+    "themes": "bible_chap_cat_webapp",
+    "category": "bible_chapter_category",
+    "tickets": "app"
+}
+
+HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+PORT = int(os.getenv("SERVER_PORT", "8000"))
+WORKERS = int(os.getenv("SERVER_WORKERS", str(multiprocessing.cpu_count())))
+# Requests mostly wait on Groq and bible-api.com, so each worker takes several at once
+THREADS = int(os.getenv("SERVER_THREADS", "8"))
+# A long chapter can spend a minute or more in the LLM scheduler and the model
+TIMEOUT = int(os.getenv("SERVER_TIMEOUT", "180"))
+GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "5"))
+# Recycle a worker after this many requests (0 never does)
+MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "0"))
+
+def load_app(name, processes):
+    """
+    Import the app and build its shared state in this (parent) process.
+    """
+    app = importlib.import_module(APPS[name]).app
+    import verse_store
+    import llm_scheduler
+    stored = verse_store.warm()
+    rpm, tpm = llm_scheduler.share_budget(processes)
+    print(f"Loaded {name} with {stored} stored chapters; LLM budget per worker: {rpm:g} RPM, {tpm:g} TPM")
+    # Objects made so far are never collected, so the collector does not
+    # touch (and copy) their pages in every worker
+    gc.freeze()
+    return app
+
+def serve_gunicorn(app, host, port, workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "threads": threads,
+                "worker_class": "gthread",
+                "timeout": TIMEOUT,
+                "graceful_timeout": GRACEFUL_TIMEOUT,
+                "keepalive": KEEPALIVE,
+                "max_requests": MAX_REQUESTS,
+                "max_requests_jitter": MAX_REQUESTS // 10,
+                "preload_app": True
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+def serve_waitress(app, host, port, threads):
+    import waitress
+    # One process; Ctrl+C / SIGTERM close the listening socket and exit
+    waitress.serve(app, host=host, port=port, threads=threads, channel_timeout=TIMEOUT)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a classifier app with a production WSGI server.")
+    parser.add_argument("app", choices=sorted(APPS))
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--threads", type=int, default=THREADS)
+    args = parser.parse_args()
+
+    use_gunicorn = hasattr(os, "fork") and importlib.util.find_spec("gunicorn") is not None
+    app = load_app(args.app, args.workers if use_gunicorn else 1)
+    if use_gunicorn:
+        serve_gunicorn(app, args.host, args.port, args.workers, args.threads)
+    elif importlib.util.find_spec("waitress"):
+        serve_waitress(app, args.host, args.port, args.threads)
+    else:
+        sys.exit("Needs a WSGI server: pip install gunicorn (Linux/macOS) or waitress (Windows)")
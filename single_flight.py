@@ -0,0 +1,89 @@
+import os
+import copy
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+# -----------------------------
+# Request coalescing (single-flight)
+# -----------------------------
+# While a key is being computed, later callers for the same key wait for
+# that result instead of starting their own fetch and LLM call. The first
+# caller (the leader) does the work; an error it raises is re-raised in
+# every waiter. Waiters give up after SINGLE_FLIGHT_TIMEOUT seconds, but
+# the leader's work carries on and still lands in the caches.
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "60"))
+
+FLIGHT_STATS = {"leaders": 0, "shared": 0, "timeouts": 0}
+
+class SingleFlight:
+    def __init__(self, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        # Async flights live on the aio loop, so they need no lock
+        self._tasks = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Return fn(*args, **kwargs), sharing one call among concurrent callers with the same key.
+        """
+        future, leader = self.claim(key)
+        if not leader:
+            return self.wait(future)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result=result)
+        return result
+
+    def claim(self, key):
+        """
+        Join the flight for key, or start one. Returns (future, leader): a
+        waiter passes the future to wait(); the leader produces the result
+        itself (e.g. from a token stream) and must end the flight with
+        finish() whatever happens.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        FLIGHT_STATS["leaders" if leader else "shared"] += 1
+        return future, leader
+
+    def wait(self, future):
+        try:
+            # Waiters get their own copy so nobody mutates a shared result
+            return copy.deepcopy(future.result(timeout=self.timeout))
+        except FutureTimeout:
+            FLIGHT_STATS["timeouts"] += 1
+            raise TimeoutError(f"Timed out after {self.timeout:g}s waiting for the same request to finish") from None
+
+    def finish(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """
+        Same as do for a coroutine function; must run on one event loop.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            FLIGHT_STATS["leaders"] += 1
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            # The leader waits without a timeout, like the sync leader
+            return await asyncio.shield(task)
+        FLIGHT_STATS["shared"] += 1
+        try:
+            return copy.deepcopy(await asyncio.wait_for(asyncio.shield(task), self.timeout))
+        except asyncio.TimeoutError:
+            FLIGHT_STATS["timeouts"] += 1
+            raise TimeoutError(f"Timed out after {self.timeout:g}s waiting for the same request to finish") from None
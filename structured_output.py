@@ -0,0 +1,152 @@
+import os
+import json
+import llm_json
+
+# -----------------------------
+# Structured-output mode
+# -----------------------------
+# STRUCTURED_OUTPUT=json_object asks the model for JSON mode;
+# STRUCTURED_OUTPUT=json_schema also sends the schema (for models that
+# support Groq structured outputs). Either way the answer is validated
+# slot by slot and only the invalid slots are sent back for a retry.
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "")
+
+def enabled():
+    return STRUCTURED_OUTPUT in ("json_object", "json_schema")
+
+def item_schema(name_field, allowed_names, allowed_verses=None, extra=None):
+    properties = {
+        name_field: {"type": "string", "enum": allowed_names},
+        "key_verse": {"type": "string"}
+    }
+    if allowed_verses:
+        properties["key_verse"]["enum"] = allowed_verses
+    properties.update(extra or {})
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+def result_schema(main_key, list_key, item, max_items):
+    return {
+        "type": "object",
+        "properties": {
+            main_key: item,
+            list_key: {"type": "array", "items": item, "maxItems": max_items}
+        },
+        "required": [main_key, list_key],
+        "additionalProperties": False
+    }
+
+def json_text(text):
+    """
+    parse callback for llm_cache: keeps the raw text (repairs quote it
+    back to the model) but lets only answers holding JSON into the cache.
+    """
+    llm_json.loads(text)
+    return text
+
+def response_format(name, schema):
+    if STRUCTURED_OUTPUT == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+    return {"type": "json_object"}
+
+# -----------------------------
+# Validation and targeted repair
+# -----------------------------
+# The main entry may have its own item schema and check (main_item,
+# is_valid_main) when its allowed values differ from the list entries';
+# both default to the list entries' item and is_valid.
+def invalid_slots(result, main_key, list_key, is_valid, is_valid_main=None):
+    """
+    Names of the entries that fail is_valid, e.g. ["main_lesson", "other_lessons[1]"].
+    """
+    is_valid_main = is_valid_main or is_valid
+    slots = []
+    if not isinstance(result.get(main_key), dict) or not is_valid_main(result[main_key]):
+        slots.append(main_key)
+    items = result.get(list_key)
+    if not isinstance(items, list):
+        result[list_key] = []
+    for i, item in enumerate(result[list_key]):
+        if not isinstance(item, dict) or not is_valid(item):
+            slots.append(f"{list_key}[{i}]")
+    return slots
+
+def repair_request(messages, raw_output, slots, item, problem, main_key=None, main_item=None):
+    """
+    Follow-up messages and response_format asking only for the invalid slots.
+    """
+    schema = {
+        "type": "object",
+        "properties": {slot: main_item if slot == main_key and main_item else item for slot in slots},
+        "required": slots,
+        "additionalProperties": False
+    }
+    followup = (
+        f"These entries in your answer are invalid: {', '.join(slots)}. {problem}\n"
+        f"Return ONLY a JSON object with exactly these keys, each holding a corrected entry: "
+        f"{json.dumps(slots)}"
+    )
+    repair_messages = messages + [
+        {"role": "assistant", "content": raw_output},
+        {"role": "user", "content": followup}
+    ]
+    return repair_messages, response_format("repair", schema)
+
+def merge_repairs(result, repairs, main_key, list_key, is_valid, is_valid_main=None):
+    """
+    Put valid replacements into place and drop list entries that are still invalid.
+    """
+    is_valid_main = is_valid_main or is_valid
+    for slot, item in repairs.items():
+        if not isinstance(item, dict):
+            continue
+        if slot == main_key:
+            if is_valid_main(item):
+                result[main_key] = item
+        elif slot.startswith(f"{list_key}[") and slot.endswith("]") and is_valid(item):
+            index = int(slot[len(list_key) + 1:-1])
+            if index < len(result[list_key]):
+                result[list_key][index] = item
+    result[list_key] = [item for item in result[list_key] if isinstance(item, dict) and is_valid(item)]
+    return result
+
+def classify(complete, messages, name, schema, main_key, list_key, item, is_valid, problem,
+             main_item=None, is_valid_main=None):
+    """
+    Run a structured classification. complete(messages, response_format)
+    returns the model's text. An invalid main entry that survives the one
+    repair round is left in place for the caller's normal handling.
+    """
+    raw_output = complete(messages, response_format(name, schema))
+    result = llm_json.loads(raw_output)
+    slots = invalid_slots(result, main_key, list_key, is_valid, is_valid_main)
+    if not slots:
+        return result
+    repair_messages, repair_format = repair_request(
+        messages, raw_output, slots, item, problem, main_key=main_key, main_item=main_item
+    )
+    try:
+        repairs = llm_json.loads(complete(repair_messages, repair_format))
+    except ValueError:
+        repairs = {}
+    return merge_repairs(result, repairs, main_key, list_key, is_valid, is_valid_main)
+
+async def classify_async(complete, messages, name, schema, main_key, list_key, item, is_valid, problem,
+                         main_item=None, is_valid_main=None):
+    raw_output = await complete(messages, response_format(name, schema))
+    result = llm_json.loads(raw_output)
+    slots = invalid_slots(result, main_key, list_key, is_valid, is_valid_main)
+    if not slots:
+        return result
+    repair_messages, repair_format = repair_request(
+        messages, raw_output, slots, item, problem, main_key=main_key, main_item=main_item
+    )
+    try:
+        repairs = llm_json.loads(await complete(repair_messages, repair_format))
+    except ValueError:
+        repairs = {}
+    return merge_repairs(result, repairs, main_key, list_key, is_valid, is_valid_main)
@@ -0,0 +1,197 @@
+import os
+import re
+import sys
+import json
+import math
+import random
+from collections import Counter, defaultdict
+
+# -----------------------------
+# Settings
+# -----------------------------
+# A multinomial naive Bayes model over words and word pairs, trained from
+# the categories the LLM has already assigned (see ticket_queue.labels).
+# It answers a ticket on its own only when its posterior for the top
+# category is at least TICKET_PRECLASSIFY_THRESHOLD; everything else goes
+# to the LLM. With no trained model file every ticket goes to the LLM.
+MODEL_PATH = os.getenv(
+    "TICKET_MODEL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "ticket_model.json")
+)
+THRESHOLD = float(os.getenv("TICKET_PRECLASSIFY_THRESHOLD", "0.95"))
+# Fraction of confident answers that are still checked against the LLM,
+# so agreement on the fast path keeps being measured
+AUDIT_RATE = float(os.getenv("TICKET_PRECLASSIFY_AUDIT_RATE", "0.02"))
+# A model needs at least two categories, each with this many labelled
+# tickets: trained on one category it would be "certain" of it for every ticket
+MIN_EXAMPLES = int(os.getenv("TICKET_PRECLASSIFY_MIN_EXAMPLES", "20"))
+
+PRECLASSIFY_STATS = {
+    "answered": 0, "deferred": 0,
+    "audit_agreed": 0, "audit_disagreed": 0,
+    "deferred_agreed": 0, "deferred_disagreed": 0
+}
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+def features(text):
+    words = TOKEN_RE.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+# -----------------------------
+# Model
+# -----------------------------
+class Preclassifier:
+    def __init__(self, priors, likelihoods, unseen, examples=None):
+        # log P(category), log P(feature | category), and the smoothed
+        # log-probability for a feature never seen with that category
+        self.priors = priors
+        self.likelihoods = likelihoods
+        self.unseen = unseen
+        # Labelled tickets per category it was trained on
+        self.examples = examples or {}
+
+    @classmethod
+    def train(cls, examples, alpha=1.0, min_examples=MIN_EXAMPLES):
+        """
+        examples is a list of (ticket_text, category). Raises ValueError
+        unless they cover two or more categories with min_examples each.
+        """
+        doc_counts = Counter(category for _, category in examples)
+        problem = coverage_problem(doc_counts, min_examples)
+        if problem:
+            raise ValueError(problem)
+        feature_counts = defaultdict(Counter)
+        for text, category in examples:
+            feature_counts[category].update(features(text))
+        vocabulary = {f for counts in feature_counts.values() for f in counts}
+        total_docs = sum(doc_counts.values())
+        priors, likelihoods, unseen = {}, {}, {}
+        for category, n in doc_counts.items():
+            counts = feature_counts[category]
+            denominator = sum(counts.values()) + alpha * len(vocabulary)
+            priors[category] = math.log(n / total_docs)
+            likelihoods[category] = {f: math.log((c + alpha) / denominator) for f, c in counts.items()}
+            unseen[category] = math.log(alpha / denominator)
+        return cls(priors, likelihoods, unseen, dict(doc_counts))
+
+    def predict(self, text):
+        """
+        Return (category, confidence) where confidence is the posterior
+        probability of that category.
+        """
+        feats = features(text)
+        scores = {}
+        for category, prior in self.priors.items():
+            table = self.likelihoods[category]
+            default = self.unseen[category]
+            scores[category] = prior + sum(table.get(f, default) for f in feats)
+        best = max(scores, key=scores.get)
+        # Softmax over log scores, shifted by the max for stability
+        total = sum(math.exp(s - scores[best]) for s in scores.values())
+        return best, 1.0 / total
+
+    def save(self, path=MODEL_PATH):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "priors": self.priors, "likelihoods": self.likelihoods,
+                "unseen": self.unseen, "examples": self.examples
+            }, f)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["priors"], data["likelihoods"], data["unseen"], data.get("examples"))
+
+def coverage_problem(doc_counts, min_examples=MIN_EXAMPLES):
+    """
+    Why labels counted per category are too few to train on, or None.
+    """
+    if len(doc_counts) < 2:
+        return f"Need labels in at least two categories, have {len(doc_counts)}."
+    short = sorted(category for category, n in doc_counts.items() if n < min_examples)
+    if short:
+        return f"Need at least {min_examples} labelled tickets per category; too few for {', '.join(short)}."
+    return None
+
+def load_default():
+    """
+    The trained model, or None if there is none or it was trained on too
+    few categories or examples (a model file from before those checks
+    records no counts, so it is not used either).
+    """
+    if not os.path.exists(MODEL_PATH):
+        return None
+    model = Preclassifier.load(MODEL_PATH)
+    if set(model.examples) != set(model.priors) or coverage_problem(model.examples):
+        return None
+    return model
+
+# -----------------------------
+# Fast path
+# -----------------------------
+def fast_answer(model, text, threshold=THRESHOLD):
+    """
+    (category, guess, audit): category is the model's answer when it is
+    confident, else None. guess is the model's best category either way
+    (for agreement stats), and audit says whether to check a confident
+    answer against the LLM anyway.
+    """
+    if model is None:
+        return None, None, False
+    guess, confidence = model.predict(text)
+    if confidence >= threshold:
+        PRECLASSIFY_STATS["answered"] += 1
+        return guess, guess, random.random() < AUDIT_RATE
+    PRECLASSIFY_STATS["deferred"] += 1
+    return None, guess, False
+
+def record_agreement(guess, llm_category, audited):
+    if guess is None or llm_category == "HUMAN_REVIEW":
+        return
+    prefix = "audit" if audited else "deferred"
+    PRECLASSIFY_STATS[f"{prefix}_{'agreed' if guess == llm_category else 'disagreed'}"] += 1
+
+# -----------------------------
+# Training and evaluation
+# -----------------------------
+def evaluate(examples, thresholds=(0.8, 0.9, 0.95, 0.99), holdout=0.2, seed=0):
+    """
+    Train on part of the labels and report, per threshold, how many of the
+    held-out tickets the model would answer and how often it matches the LLM.
+    """
+    examples = list(examples)
+    random.Random(seed).shuffle(examples)
+    split = int(len(examples) * (1 - holdout))
+    model = Preclassifier.train(examples[:split])
+    test = [(model.predict(text), label) for text, label in examples[split:]]
+    for threshold in thresholds:
+        answered = [(guess, label) for (guess, confidence), label in test if confidence >= threshold]
+        agreed = sum(guess == label for guess, label in answered)
+        coverage = len(answered) / len(test) if test else 0.0
+        agreement = agreed / len(answered) if answered else 0.0
+        print(f"threshold {threshold:.2f}: answers {coverage:6.1%} of tickets, agrees with the LLM {agreement:6.1%}")
+
+if __name__ == "__main__":
+    import ticket_queue
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    labels = ticket_queue.labels()
+    if command == "train":
+        if not labels:
+            sys.exit("No LLM labels logged yet; classify some tickets first.")
+        try:
+            model = Preclassifier.train(labels)
+        except ValueError as e:
+            sys.exit(f"{e} Classify more tickets first.")
+        model.save(MODEL_PATH)
+        print(f"Trained on {len(labels)} labelled tickets -> {MODEL_PATH}")
+    elif command == "evaluate":
+        if len(labels) < 10:
+            sys.exit("Need at least 10 logged labels to evaluate.")
+        try:
+            evaluate(labels)
+        except ValueError as e:
+            sys.exit(f"{e} Classify more tickets first.")
+    else:
+        print("usage: python ticket_preclassifier.py train | evaluate")
@@ -0,0 +1,300 @@
+import os
+import time
+import uuid
+import queue
+import socket
+import sqlite3
+import ipaddress
+import urllib.parse
+import logging
+import threading
+import requests
+
+# -----------------------------
+# Settings
+# -----------------------------
+# Tickets accepted by /tickets are stored here with their status, so any
+# worker process can answer GET /tickets/<id>.
+DB_PATH = os.getenv(
+    "TICKET_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tickets.db")
+)
+# Up to BATCH_SIZE queued tickets go into one LLM prompt; a worker waits at
+# most BATCH_WAIT seconds after the first ticket for the batch to fill.
+BATCH_SIZE = int(os.getenv("TICKET_BATCH_SIZE", "16"))
+BATCH_WAIT = float(os.getenv("TICKET_BATCH_WAIT", "0.05"))
+WORKERS = int(os.getenv("TICKET_WORKERS", "4"))
+WEBHOOK_TIMEOUT = float(os.getenv("TICKET_WEBHOOK_TIMEOUT", "5"))
+# Webhooks may only point at these hosts (comma-separated). Left empty, any
+# host is allowed whose addresses are all public, so a webhook cannot be
+# used to reach loopback, private or link-local services.
+WEBHOOK_HOSTS = {h.strip().lower() for h in os.getenv("TICKET_WEBHOOK_HOSTS", "").split(",") if h.strip()}
+# Queued tickets belong to the process that accepted them, which renews
+# its claim every RECLAIM_AFTER / 3 seconds. Tickets whose claim is older
+# than RECLAIM_AFTER (their process exited or was restarted) are taken
+# over by a running queue.
+RECLAIM_AFTER = float(os.getenv("TICKET_RECLAIM_AFTER", "60"))
+
+# Pause before a batch that hit an unexpected error (e.g. a locked store) is retried
+RETRY_DELAY = float(os.getenv("TICKET_RETRY_DELAY", "1"))
+
+QUEUE_STATS = {
+    "accepted": 0, "batches": 0, "classified": 0, "failed": 0, "retried": 0,
+    "reclaimed": 0, "webhook_errors": 0
+}
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tickets ("
+            "id TEXT PRIMARY KEY, ticket TEXT NOT NULL, status TEXT NOT NULL, "
+            "category TEXT, error TEXT, webhook TEXT, created REAL NOT NULL, updated REAL NOT NULL, "
+            "claim TEXT, claimed REAL)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(tickets)")}
+        if "claim" not in columns:
+            # Stores created before queued tickets could be reclaimed
+            conn.execute("ALTER TABLE tickets ADD COLUMN claim TEXT")
+            conn.execute("ALTER TABLE tickets ADD COLUMN claimed REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS tickets_by_status ON tickets (status, claimed)")
+        # Categories assigned by the LLM, kept as training data for ticket_preclassifier
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS labels (ticket TEXT NOT NULL, category TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+def _reset_after_fork():
+    # The parent's connection is unusable in a forked worker
+    global _local
+    _local = threading.local()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get(ticket_id):
+    row = _connect().execute(
+        "SELECT id, ticket, status, category, error, created, updated FROM tickets WHERE id = ?", (ticket_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    keys = ("id", "ticket", "status", "category", "error", "created", "updated")
+    return {k: v for k, v in zip(keys, row) if v is not None}
+
+def _finish(items, categories=None, error=None):
+    now = time.time()
+    conn = _connect()
+    with conn:
+        for i, (ticket_id, _, _) in enumerate(items):
+            if error is None:
+                conn.execute(
+                    "UPDATE tickets SET status = 'done', category = ?, updated = ? WHERE id = ?",
+                    (categories[i], now, ticket_id)
+                )
+            else:
+                conn.execute(
+                    "UPDATE tickets SET status = 'failed', error = ?, updated = ? WHERE id = ?",
+                    (error, now, ticket_id)
+                )
+
+def _renew(claim):
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE tickets SET claimed = ? WHERE status = 'queued' AND claim = ?", (time.time(), claim)
+        )
+
+def _reclaim(claim):
+    """
+    Take over queued tickets whose claim has lapsed; returns them as queue items.
+    """
+    now = time.time()
+    conn = _connect()
+    with conn:
+        # One UPDATE hands the rows over, so two processes cannot both take them
+        conn.execute(
+            "UPDATE tickets SET claim = ?, claimed = ? "
+            "WHERE status = 'queued' AND (claimed IS NULL OR claimed < ?)",
+            (claim, now, now - RECLAIM_AFTER)
+        )
+        return conn.execute(
+            "SELECT id, ticket, webhook FROM tickets WHERE status = 'queued' AND claim = ? AND claimed = ?",
+            (claim, now)
+        ).fetchall()
+
+def check_webhook(url):
+    """
+    Raise ValueError unless url is an http(s) URL results may be POSTed to.
+    """
+    parts = urllib.parse.urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError("webhook must be an http or https URL")
+    if WEBHOOK_HOSTS:
+        if host not in WEBHOOK_HOSTS:
+            raise ValueError(f"webhook host {host} is not allowed")
+        return url
+    try:
+        infos = socket.getaddrinfo(host, parts.port or 443, proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError):
+        raise ValueError(f"webhook host {host} could not be resolved") from None
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        address = getattr(address, "ipv4_mapped", None) or address
+        if not address.is_global or address.is_multicast:
+            raise ValueError("webhook must point to a public address")
+    return url
+
+def record_labels(pairs):
+    """
+    Log (ticket_text, category) pairs answered by the LLM.
+    """
+    if not pairs:
+        return
+    now = time.time()
+    conn = _connect()
+    with conn:
+        conn.executemany(
+            "INSERT INTO labels (ticket, category, created) VALUES (?, ?, ?)",
+            [(text, category, now) for text, category in pairs]
+        )
+
+def labels():
+    return _connect().execute("SELECT ticket, category FROM labels").fetchall()
+
+# -----------------------------
+# Micro-batching workers
+# -----------------------------
+class TicketQueue:
+    """
+    Accepts tickets immediately and classifies them in the background.
+    classify_batch(list_of_texts) must return one category per text, in order.
+    Workers start on the first submit or status poll, so a forking server
+    starts them in each worker process rather than in the parent; from
+    then on they also pick up tickets left queued by a process that went
+    away.
+    """
+    def __init__(self, classify_batch, batch_size=BATCH_SIZE, batch_wait=BATCH_WAIT, workers=WORKERS):
+        self.classify_batch = classify_batch
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._alive = 0
+
+    def submit(self, ticket_texts, webhook=None):
+        """
+        Store and enqueue tickets in one transaction; returns their IDs.
+        """
+        self.start()
+        items = [(uuid.uuid4().hex, text, webhook) for text in ticket_texts]
+        now = time.time()
+        conn = _connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO tickets (id, ticket, status, webhook, created, updated, claim, claimed) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                [(ticket_id, text, webhook, now, now, self._claim, now) for ticket_id, text, webhook in items]
+            )
+        for item in items:
+            self._queue.put(item)
+        QUEUE_STATS["accepted"] += len(items)
+        return [ticket_id for ticket_id, _, _ in items]
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        """
+        Start the workers in this process if they are not running yet.
+        """
+        with self._start_lock:
+            if self._started:
+                return
+            # Made here, not in __init__, so every forked worker has its own
+            self._claim = uuid.uuid4().hex
+            self._alive = self.workers
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f"ticket-worker-{i}", daemon=True).start()
+            threading.Thread(target=self._keep_claims, name="ticket-reclaimer", daemon=True).start()
+            self._started = True
+
+    def _keep_claims(self):
+        while True:
+            items = []
+            # With no worker left to classify them, the claims are left to
+            # lapse so another process takes the tickets over
+            if self._alive:
+                try:
+                    _renew(self._claim)
+                    items = _reclaim(self._claim)
+                except sqlite3.Error:
+                    log.exception("Could not renew or reclaim queued tickets")
+            for item in items:
+                self._queue.put(tuple(item))
+            QUEUE_STATS["reclaimed"] += len(items)
+            time.sleep(RECLAIM_AFTER / 3)
+
+    def _next_batch(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _work(self):
+        try:
+            while True:
+                items = self._next_batch()
+                QUEUE_STATS["batches"] += 1
+                try:
+                    self._run(items)
+                except Exception:
+                    # Usually the store ("database is locked"): the tickets are
+                    # still queued, so put them back rather than lose the thread
+                    log.exception("Ticket batch of %d failed; retrying", len(items))
+                    QUEUE_STATS["retried"] += len(items)
+                    time.sleep(RETRY_DELAY)
+                    for item in items:
+                        self._queue.put(item)
+        finally:
+            with self._start_lock:
+                self._alive -= 1
+
+    def _run(self, items):
+        try:
+            categories = self.classify_batch([text for _, text, _ in items])
+        except Exception as e:
+            _finish(items, error=str(e))
+            QUEUE_STATS["failed"] += len(items)
+            self._notify(items, error=str(e))
+            return
+        _finish(items, categories=categories)
+        QUEUE_STATS["classified"] += len(items)
+        self._notify(items, categories=categories)
+
+    def _notify(self, items, categories=None, error=None):
+        for i, (ticket_id, _, webhook) in enumerate(items):
+            if not webhook:
+                continue
+            payload = {"id": ticket_id}
+            payload.update({"status": "failed", "error": error} if error else {"status": "done", "category": categories[i]})
+            try:
+                # Checked again here: the name may resolve elsewhere by now.
+                # Redirects are not followed for the same reason.
+                check_webhook(webhook)
+                requests.post(webhook, json=payload, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+            except (ValueError, requests.RequestException):
+                QUEUE_STATS["webhook_errors"] += 1
@@ -0,0 +1,100 @@
+import time
+import bisect
+import functools
+import threading
+import contextlib
+from collections import deque
+
+# -----------------------------
+# Stage timing spans
+# -----------------------------
+# Wall-clock time per pipeline stage (fetch, prompt, llm, parse, enrich,
+# normalize, render), aggregated per process. A span costs two
+# perf_counter() calls and one short locked update, so it stays on in
+# production. The most recent durations are kept for percentiles.
+SAMPLES_PER_STAGE = 10000
+# Histogram bucket bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_STATS = {}
+_lock = threading.Lock()
+
+def record(stage, seconds):
+    with _lock:
+        stats = STAGE_STATS.get(stage)
+        if stats is None:
+            stats = STAGE_STATS[stage] = {
+                "count": 0, "total": 0.0, "max": 0.0, "samples": deque(maxlen=SAMPLES_PER_STAGE),
+                "buckets": [0] * len(BUCKETS)
+            }
+        stats["count"] += 1
+        # Per-bucket counts; anything slower than the last bound only shows in +Inf (count)
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            stats["buckets"][index] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+        stats["samples"].append(seconds)
+
+@contextlib.contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def timed(stage):
+    """
+    Decorator form of span for a whole (sync) function.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def snapshot():
+    """
+    {stage: {"count", "mean", "p50", "p95", "max"}} in seconds.
+    """
+    with _lock:
+        stages = {stage: (s["count"], s["total"], s["max"], list(s["samples"])) for stage, s in STAGE_STATS.items()}
+    return {
+        stage: {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "max": peak
+        }
+        for stage, (count, total, peak, samples) in stages.items()
+    }
+
+def histograms():
+    """
+    {stage: (cumulative bucket counts, sum, count)} for exposition.
+    """
+    with _lock:
+        stages = {stage: (list(s["buckets"]), s["total"], s["count"]) for stage, s in STAGE_STATS.items()}
+    result = {}
+    for stage, (buckets, total, count) in stages.items():
+        cumulative, running = [], 0
+        for n in buckets:
+            running += n
+            cumulative.append(running)
+        result[stage] = (cumulative, total, count)
+    return result
+
+def reset():
+    with _lock:
+        STAGE_STATS.clear()
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import bible_fetch
+import aio
+import bible_refs
+import timing
+
+# -----------------------------
+# Local verse store
+# -----------------------------
+# Scripture text never changes, so every chapter fetched from bible-api.com
+# is kept in a small SQLite file shared by all the apps. Set BIBLE_VERSE_DB
+# to move it (e.g. onto a shared volume).
+DB_PATH = os.getenv(
+    "BIBLE_VERSE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "verses.db")
+)
+
+STORE_STATS = {"hits": 0, "misses": 0}
+
+# Chapters loaded by warm(); read before SQLite
+_memory = {}
+
+_local = threading.local()
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS chapters (ref TEXT PRIMARY KEY, verses TEXT NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+def _reset_after_fork():
+    # Workers forked by serve.py open their own connection on first use
+    global _local
+    _local = threading.local()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def normalize_ref(chapter_ref):
+    """
+    Store key for a chapter: its canonical ref, lower-cased ("rom 8" -> "romans 8").
+    Raises ValueError for refs that are not a chapter of the canon.
+    """
+    return bible_refs.canonical_ref(chapter_ref).lower()
+
+# -----------------------------
+# Read-through lookup
+# -----------------------------
+def _lookup(key):
+    verses = _memory.get(key)
+    if verses is not None:
+        STORE_STATS["hits"] += 1
+        return verses
+    row = _connect().execute("SELECT verses FROM chapters WHERE ref = ?", (key,)).fetchone()
+    if row:
+        STORE_STATS["hits"] += 1
+        return json.loads(row[0])
+    STORE_STATS["misses"] += 1
+    return None
+
+def _save(key, verses):
+    if verses:
+        conn = _connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chapters (ref, verses) VALUES (?, ?)",
+                (key, json.dumps(verses))
+            )
+
+def get_chapter(chapter_ref):
+    """
+    Return the verses for a chapter, hitting bible-api.com only on a miss.
+    """
+    with timing.span("fetch"):
+        key = normalize_ref(chapter_ref)
+        verses = _lookup(key)
+        if verses is None:
+            verses = bible_fetch.fetch_chapter(key)
+            _save(key, verses)
+        return verses
+
+async def get_chapter_async(chapter_ref):
+    with timing.span("fetch"):
+        key = normalize_ref(chapter_ref)
+        # Only a chapter not in memory needs SQLite, which runs off the loop
+        verses = _lookup(key) if key in _memory else await aio.blocking(_lookup, key)
+        if verses is None:
+            verses = await bible_fetch.fetch_chapter_async(key)
+            await aio.blocking(_save, key, verses)
+        return verses
+
+def warm():
+    """
+    Load every stored chapter into memory. serve.py calls this before
+    forking, so all workers share one copy of the text.
+    """
+    conn = _connect()
+    _memory.update((ref, json.loads(verses)) for ref, verses in conn.execute("SELECT ref, verses FROM chapters"))
+    return len(_memory)
+
+def stored_refs():
+    conn = _connect()
+    return {row[0] for row in conn.execute("SELECT ref FROM chapters")}
+
+# -----------------------------
+# Bulk preload
+# -----------------------------
+def preload(delay=2.0):
+    """
+    Fill the store with every chapter of the canon, skipping chapters that
+    are already stored so an interrupted run can simply be restarted.
+    """
+    have = stored_refs()
+    todo = [ref for ref in bible_refs.canon_refs() if normalize_ref(ref) not in have]
+    print(f"{len(have)} chapters stored, {len(todo)} to fetch")
+    for i, ref in enumerate(todo, start=1):
+        verses = get_chapter(ref)
+        status = "ok" if verses else "FAILED"
+        print(f"[{i}/{len(todo)}] {ref}: {status}")
+        # bible-api.com rate-limits aggressive clients
+        time.sleep(delay)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "preload":
+        preload(delay=float(sys.argv[2]) if len(sys.argv) > 2 else 2.0)
+    elif len(sys.argv) >= 2 and sys.argv[1] == "stats":
+        print(f"{len(stored_refs())} of {len(bible_refs.canon_refs())} chapters stored in {DB_PATH}")
+    else:
+        print("usage: python verse_store.py preload [delay_seconds] | stats")